@@ -1,18 +1,27 @@
-from azure.ai.formrecognizer import DocumentAnalysisClient
+from azure.ai.formrecognizer.aio import DocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError, ServiceRequestError
+from botocore.exceptions import ClientError, EndpointConnectionError, ConnectionClosedError
 from datetime import datetime
-from typing import Dict, Any, BinaryIO
+from typing import Dict, Any, BinaryIO, Callable, ClassVar, Tuple
 import logging
-import json
+import orjson
 import io
 import os
-import pandas as pd
+import csv
 from pathlib import Path
 import fitz  # PyMuPDF for image extraction
 import asyncio
-from functools import wraps
+import aiohttp
+from functools import wraps, partial
 from fastapi import HTTPException
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, nullcontext
+
+from PDF.pdf_utils import (
+    PdfSource, extract_pages, extract_images, name_images, open_document, close_document, hash_source,
+    CPU_POOL, FITZ_POOL, IO_POOL
+)
+from s3.s3 import compress_for_upload
 
 logger = logging.getLogger(__name__)
 
@@ -27,8 +36,134 @@ async def async_timeout(timeout: float):
             detail=f"Operation timed out after {timeout} seconds"
         )
 
+def _table_to_csv(table: list) -> io.BytesIO:
+    """Serialize table rows straight into a UTF-8 CSV buffer"""
+    buffer = io.BytesIO()
+    writer = io.TextIOWrapper(buffer, encoding='utf-8', newline='', write_through=True)
+    csv.writer(writer).writerows(table)
+    writer.detach()  # keep the buffer open once the wrapper is released
+    buffer.seek(0)
+    return buffer
+
+def _page_text(page) -> str:
+    """Join the lines of an analyzed page; the single place page text is assembled"""
+    return "\n".join(line.content for line in page.lines)
+
+def _table_grid(table) -> list:
+    """Fill a preallocated row/column grid in one pass over the table cells"""
+    table_data = [[''] * table.column_count for _ in range(table.row_count)]
+    for cell in table.cells:
+        table_data[cell.row_index][cell.column_index] = cell.content
+    return table_data
+
+# When enabled, born-digital PDFs with at least this much text in their first pages
+# skip Azure OCR; they then get no Azure tables or key-value pairs
+TEXT_LAYER_SAMPLE_PAGES = 3
+TEXT_LAYER_THRESHOLD = 200
+
+UPLOAD_CONCURRENCY = 8
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+def _is_transient(error: Exception) -> bool:
+    """Whether an Azure, HTTP or S3 error is worth retrying"""
+    if isinstance(error, (ServiceRequestError, aiohttp.ClientError, EndpointConnectionError, ConnectionClosedError)):
+        return True
+    if isinstance(error, HttpResponseError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    if isinstance(error, ClientError):
+        return error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') in RETRYABLE_STATUS_CODES
+    return False
+
+class _UploadPipeline:
+    """Uploads artifacts in the background as soon as they are queued"""
+
+    def __init__(self, storage_client, executor, base_folder: str, retry: Callable, concurrency: int = UPLOAD_CONCURRENCY):
+        self.storage_client = storage_client
+        self.executor = executor
+        self.base_folder = base_folder
+        self._retry = retry
+        self.storage_paths = {}
+        self.errors = []
+        self._image_keys = set()
+        self._image_names = {}
+        self._closed = False
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(concurrency)]
+
+    def put(self, name: str, body: BinaryIO, key: str, content_type: str, content_encoding: str = None):
+        """Queue an artifact for upload from the event loop"""
+        # Artifacts arriving after the request finished, failed or was cancelled are dropped
+        if self._closed:
+            return
+        self._queue.put_nowait((name, body, key, content_type, content_encoding))
+
+    def put_threadsafe(self, name: str, body: BinaryIO, key: str, content_type: str, content_encoding: str = None):
+        """Queue an artifact for upload from a worker thread"""
+        if self._closed:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self.put, name, body, key, content_type, content_encoding)
+        except RuntimeError:
+            # The event loop has shut down; nothing would upload this any more
+            pass
+
+    def put_images(self, images: list, threadsafe: bool = False):
+        """Queue extracted images for upload, recording each image's storage key.
+
+        Images are named after their first page and PDF xref, so an image repeated
+        across pages (logos, headers) is uploaded once and every occurrence points at it.
+        """
+        put = self.put_threadsafe if threadsafe else self.put
+        name_images(images, self._image_names)
+        for img in images:
+            key = f"{self.base_folder}/images/{img['name']}"
+            img['storage_key'] = key
+            if key not in self._image_keys:
+                self._image_keys.add(key)
+                put(img['name'], img['data'], key, f"image/{img['ext']}")
+
+    def put_images_threadsafe(self, images: list):
+        """Queue extracted images for upload from a worker thread"""
+        if not self._closed:
+            self.put_images(images, threadsafe=True)
+
+    async def _worker(self):
+        while True:
+            name, body, key, content_type, content_encoding = await self._queue.get()
+            try:
+                upload = partial(
+                    self.storage_client.upload, body, key, content_type, content_encoding=content_encoding
+                )
+                await self._retry(self._loop.run_in_executor, self.executor, upload)
+                self.storage_paths[name] = key
+            except Exception as e:
+                logger.error(f"Error uploading {key}: {str(e)}")
+                self.errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    async def join(self) -> Dict[str, str]:
+        """Wait for every queued upload and return the stored paths"""
+        await self._queue.join()
+        if self.errors:
+            raise self.errors[0]
+        return self.storage_paths
+
+    def close(self):
+        """Stop accepting artifacts, cancel the workers and free whatever is still queued"""
+        self._closed = True
+        for worker in self._workers:
+            worker.cancel()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            self._queue.task_done()
+
 class PDFEnterpriseProcessor:
-    def __init__(self, storage_client=None, timeout: int = 300, max_retries: int = 3, retry_delay: int = 5):
+    _client_cache: ClassVar[Dict[Tuple[str, str], DocumentAnalysisClient]] = {}
+
+    def __init__(self, storage_client=None, timeout: int = 300, max_retries: int = 3, retry_delay: int = 5,
+                 skip_azure_for_text_pdfs: bool = None):
         """Initialize PDFEnterpriseProcessor with Azure Document Intelligence client"""
         self.storage_client = storage_client
         self.timeout = timeout
@@ -36,6 +171,11 @@ class PDFEnterpriseProcessor:
         self.retry_delay = retry_delay
         self.base_path = "PDF/Enterprise/"
         
+        # Off by default: Azure is what provides tables and key-value pairs
+        if skip_azure_for_text_pdfs is None:
+            skip_azure_for_text_pdfs = os.getenv("PDF_SKIP_AZURE_FOR_TEXT_PDFS", "false").lower() == "true"
+        self.skip_azure_for_text_pdfs = skip_azure_for_text_pdfs
+        
         # Initialize Azure credentials
         self.endpoint = os.getenv("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT")
         self.key = os.getenv("AZURE_DOCUMENT_INTELLIGENCE_KEY")
@@ -46,12 +186,19 @@ class PDFEnterpriseProcessor:
             self.use_fallback = True
         else:
             try:
-                self.document_analysis_client = DocumentAnalysisClient(
-                    endpoint=self.endpoint,
-                    credential=AzureKeyCredential(self.key)
-                )
+                # Share one client (and its pooled connections) per set of credentials
+                cache_key = (self.endpoint, self.key)
+                self.document_analysis_client = self._client_cache.get(cache_key)
+                if self.document_analysis_client is None:
+                    self.document_analysis_client = self._client_cache.setdefault(
+                        cache_key,
+                        DocumentAnalysisClient(
+                            endpoint=self.endpoint,
+                            credential=AzureKeyCredential(self.key)
+                        )
+                    )
+                    logger.info("Azure Document Intelligence client initialized successfully")
                 self.use_fallback = False
-                logger.info("Azure Document Intelligence client initialized successfully")
             except Exception as e:
                 logger.error(f"Error initializing Azure Document Intelligence client: {str(e)}")
                 self.document_analysis_client = None
@@ -59,62 +206,48 @@ class PDFEnterpriseProcessor:
 
     def _extract_images_from_pdf(self, pdf_file: BinaryIO) -> list:
         """Extract images from PDF using PyMuPDF"""
-        images = []
+        doc = None
         try:
-            # Create a temporary copy of the PDF file
-            temp_pdf = io.BytesIO(pdf_file.read())
-            pdf_file.seek(0)  # Reset file pointer for later use
-            
-            # Open PDF with PyMuPDF
-            doc = fitz.open(stream=temp_pdf, filetype="pdf")
-            
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                image_list = page.get_images()
-                
-                for img_idx, img in enumerate(image_list):
-                    try:
-                        xref = img[0]
-                        base_image = doc.extract_image(xref)
-                        image_data = {
-                            'data': base_image["image"],
-                            'ext': base_image["ext"],
-                            'page': page_num + 1,
-                            'index': img_idx + 1
-                        }
-                        images.append(image_data)
-                    except Exception as e:
-                        logger.warning(f"Failed to extract image {img_idx} from page {page_num + 1}: {str(e)}")
-            
-            doc.close()
-            return images
+            # Let MuPDF read real files from disk; only buffer in-memory streams
+            file_name = getattr(pdf_file, 'name', None)
+            if isinstance(file_name, str) and os.path.isfile(file_name):
+                doc = fitz.open(file_name)
+            else:
+                data = pdf_file.read()
+                pdf_file.seek(0)  # Reset file pointer for later use
+                doc = fitz.open(stream=data, filetype="pdf")
+                del data
+            return extract_images(doc)
             
         except Exception as e:
             logger.error(f"Error extracting images from PDF: {str(e)}")
             return []
+        finally:
+            if doc:
+                close_document(doc)
 
-    def _extract_content(self, pdf_file: BinaryIO) -> Dict:
+    async def _extract_content(self, pdf_file: BinaryIO) -> Dict:
         """Extract content using Azure Document Intelligence"""
         if not self.document_analysis_client:
             raise ValueError("Azure Document Intelligence client not initialized")
 
         try:
             # Extract images first using PyMuPDF
-            images = self._extract_images_from_pdf(pdf_file)
+            loop = asyncio.get_event_loop()
+            images = await loop.run_in_executor(FITZ_POOL, self._extract_images_from_pdf, pdf_file)
             
             # Process with Azure Document Intelligence
-            poller = self.document_analysis_client.begin_analyze_document(
-                "prebuilt-document", document=pdf_file
-            )
-            result = poller.result()
+            async def analyze():
+                pdf_file.seek(0)
+                return await self.document_analysis_client.begin_analyze_document(
+                    "prebuilt-document", document=pdf_file
+                )
+
+            poller = await self._retry(analyze)
+            result = await poller.result()
 
             # Extract text content page by page
-            text_content = []
-            for page in result.pages:
-                page_text = ""
-                for line in page.lines:
-                    page_text += line.content + "\n"
-                text_content.append(page_text)
+            text_content = [_page_text(page) + "\n" for page in result.pages]
 
             # Extract tables with proper structure
             tables = []
@@ -151,80 +284,105 @@ class PDFEnterpriseProcessor:
             logger.error(f"Error in content extraction: {str(e)}")
             raise
 
-    async def _store_content(self, content: Dict, doc_id: str) -> Dict[str, str]:
+    async def _retry(self, fn: Callable, *args, **kwargs):
+        """Await fn(*args, **kwargs), retrying transient failures with exponential backoff"""
+        # Always make at least one attempt, whatever max_retries is set to
+        attempts = max(1, self.max_retries)
+        for attempt in range(attempts):
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == attempts - 1 or not _is_transient(e):
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning(f"Attempt {attempt + 1} failed: {str(e)}, retrying in {delay} seconds...")
+                await asyncio.sleep(delay)
+
+    def _new_pipeline(self, doc_id: str) -> _UploadPipeline:
+        return _UploadPipeline(self.storage_client, IO_POOL, f"{self.base_path}{doc_id}", self._retry)
+
+    async def _store_content(self, content: Dict, doc_id: str, pipeline: _UploadPipeline = None) -> Dict[str, str]:
         """Store extracted content in different formats"""
+        if not self.storage_client:
+            return {}
+
+        owns_pipeline = pipeline is None
+        if owns_pipeline:
+            pipeline = self._new_pipeline(doc_id)
+
         try:
-            storage_paths = {}
-            base_folder = f"{self.base_path}{doc_id}"
+            base_folder = pipeline.base_folder
 
-            if self.storage_client:
-                # Run storage operations in thread pool
-                loop = asyncio.get_event_loop()
-                
-                # Store text content
-                text_content = "\n\n".join(content["text_content"])
-                text_key = f"{base_folder}/text_content.txt"
-                await loop.run_in_executor(
-                    None,
-                    lambda: self.storage_client.upload(
-                        io.BytesIO(text_content.encode('utf-8')),
-                        text_key,
-                        'text/plain'
-                    )
-                )
-                storage_paths['text'] = text_key
-
-                # Store tables as CSV files
-                for idx, table in enumerate(content["tables"]):
-                    df = pd.DataFrame(table)
-                    csv_buffer = io.StringIO()
-                    df.to_csv(csv_buffer, index=False)
-                    table_key = f"{base_folder}/table_{idx+1}.csv"
-                    await loop.run_in_executor(
-                        None,
-                        lambda: self.storage_client.upload(
-                            io.BytesIO(csv_buffer.getvalue().encode('utf-8')),
-                            table_key,
-                            'text/csv'
-                        )
-                    )
-                    storage_paths[f'table_{idx+1}'] = table_key
-
-                # Store metadata
-                metadata_key = f"{base_folder}/metadata.json"
-                metadata_json = json.dumps(content["metadata"])
-                await loop.run_in_executor(
-                    None,
-                    lambda: self.storage_client.upload(
-                        io.BytesIO(metadata_json.encode('utf-8')),
-                        metadata_key,
-                        'application/json'
-                    )
+            # Store images that were not already streamed during extraction
+            pending_images = [img for img in content.get("images", []) if 'storage_key' not in img]
+            if pending_images:
+                pipeline.put_images(pending_images)
+
+            # Store text content, zstd-compressed when it is large enough to benefit
+            text_content = "\n\n".join(content["text_content"])
+            text_body, text_key, text_encoding = compress_for_upload(
+                text_content.encode('utf-8'), f"{base_folder}/text_content.txt"
+            )
+            pipeline.put('text', text_body, text_key, 'text/plain', text_encoding)
+
+            # Store tables as CSV files
+            for idx, table in enumerate(content["tables"]):
+                pipeline.put(
+                    f'table_{idx+1}',
+                    _table_to_csv(table),
+                    f"{base_folder}/table_{idx+1}.csv",
+                    'text/csv'
                 )
-                storage_paths['metadata'] = metadata_key
 
-            return storage_paths
+            # Store metadata, zstd-compressed when it is large enough to benefit
+            metadata_body, metadata_key, metadata_encoding = compress_for_upload(
+                orjson.dumps(content["metadata"]), f"{base_folder}/metadata.json"
+            )
+            pipeline.put('metadata', metadata_body, metadata_key, 'application/json', metadata_encoding)
+
+            return await pipeline.join()
 
         except Exception as e:
             logger.error(f"Error storing content: {str(e)}")
             raise
+        finally:
+            if owns_pipeline:
+                pipeline.close()
 
-    async def process_pdf(self, file_path: str) -> Dict[str, Any]:
-        """Process PDF file with retry mechanism"""
+    async def process_pdf(self, source: PdfSource, filename: str = None) -> Dict[str, Any]:
+        """Process a PDF given as a file path or as its raw bytes, with retry mechanism"""
+        pipeline = None
+        text_doc = None
         try:
+            # Optionally only send scanned PDFs to Azure; born-digital ones already have a text layer
+            use_fallback = self.use_fallback
+            if not use_fallback and self.skip_azure_for_text_pdfs:
+                loop = asyncio.get_running_loop()
+                text_doc = await loop.run_in_executor(FITZ_POOL, self._open_if_text_layer, source)
+                use_fallback = text_doc is not None
+
             # Generate document ID first
-            doc_id = self._generate_document_id(file_path)
+            doc_id = await self._generate_document_id(source, use_fallback)
             timestamp = datetime.now().isoformat()
 
-            if self.use_fallback:
-                result = await self._extract_content_fallback(file_path)
+            # Start the uploader before extraction so artifacts are stored as soon as they are ready
+            if self.storage_client:
+                pipeline = self._new_pipeline(doc_id)
+
+            if use_fallback:
+                # The sampled document is handed over and closed by the extraction
+                doc, text_doc = text_doc, None
+                result = await self._extract_content_fallback(source, pipeline, doc)
             else:
-                result = await self._extract_content_azure(file_path)
+                result = await self._extract_content_azure(source)
             
-            # Store content if storage client is available
+            # Store the remaining content and wait for all uploads to finish
             storage_paths = {}
-            if self.storage_client:
-                storage_paths = await self._store_content(result, doc_id)
+            if pipeline:
+                storage_paths = await self._store_content(result, doc_id, pipeline)
+            
+            # Return image references only; clients fetch the bytes from storage on demand
+            images = [self._image_reference(img) for img in result.get("images", [])]
             
             return {
                 "status": "success",
@@ -234,13 +392,13 @@ class PDFEnterpriseProcessor:
                 "content": {
                     "text": result.get("text_content", []),
                     "tables": result.get("tables", []),
-                    "images": result.get("images", []),
+                    "images": images,
                     "key_value_pairs": result.get("key_value_pairs", {})
                 },
                 "metadata": {
-                    "filename": os.path.basename(file_path),
+                    "filename": filename or (os.path.basename(source) if isinstance(source, str) else ""),
                     "timestamp": timestamp,
-                    "processor": "PyMuPDF (fallback)" if self.use_fallback else "Azure Document Intelligence",
+                    "processor": "PyMuPDF (fallback)" if use_fallback else "Azure Document Intelligence",
                     "page_count": result.get("metadata", {}).get("page_count", 0),
                     "storage_paths": storage_paths
                 }
@@ -252,15 +410,48 @@ class PDFEnterpriseProcessor:
                 status_code=500,
                 detail=f"Error processing PDF: {str(e)}"
             )
+        finally:
+            if pipeline:
+                pipeline.close()
+            if text_doc is not None:
+                await asyncio.get_running_loop().run_in_executor(FITZ_POOL, close_document, text_doc)
 
-    async def _extract_content_azure(self, file_path: str) -> Dict[str, Any]:
+    def _open_if_text_layer(self, source: PdfSource):
+        """Return the opened PDF if its first pages already carry extractable text, else None"""
+        doc = None
+        try:
+            doc = open_document(source)
+            sample_pages = min(TEXT_LAYER_SAMPLE_PAGES, len(doc))
+            text_length = sum(len(doc[page_num].get_text().strip()) for page_num in range(sample_pages))
+            if text_length > TEXT_LAYER_THRESHOLD:
+                logger.info(f"PDF has an embedded text layer ({text_length} chars sampled), skipping Azure")
+                doc, text_doc = None, doc
+                return text_doc
+            return None
+        except Exception as e:
+            logger.warning(f"Error sampling PDF text layer: {str(e)}")
+            return None
+        finally:
+            if doc:
+                close_document(doc)
+
+    def _image_reference(self, img: Dict[str, Any]) -> Dict[str, Any]:
+        """Describe an extracted image without its raw bytes"""
+        reference = {
+            'page': img['page'],
+            'index': img['index'],
+            'ext': img['ext']
+        }
+        if self.storage_client and 'storage_key' in img:
+            reference['storage_key'] = img['storage_key']
+            reference['url'] = self.storage_client.get_url(img['storage_key'])
+        return reference
+
+    async def _extract_content_azure(self, source: PdfSource) -> Dict[str, Any]:
         """Extract content using Azure Document Intelligence"""
         try:
-            # Run the Azure processing in a thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            
             async with async_timeout(self.timeout):
-                result = await loop.run_in_executor(None, self._process_with_azure, file_path)
+                result = await self._process_with_azure(source)
             
             return result
             
@@ -274,60 +465,50 @@ class PDFEnterpriseProcessor:
             logger.error(f"Error in Azure PDF processing: {str(e)}")
             raise
 
-    def _process_with_azure(self, file_path: str) -> Dict[str, Any]:
-        """Synchronous Azure processing"""
-        with open(file_path, "rb") as f:
-            poller = self.document_analysis_client.begin_analyze_document(
-                "prebuilt-document", document=f
-            )
-            result = poller.result()
+    async def _process_with_azure(self, source: PdfSource) -> Dict[str, Any]:
+        """Asynchronous Azure processing"""
+        # In-memory PDFs are sent as-is; only paths need a file handle
+        with open(source, "rb") if isinstance(source, str) else nullcontext(io.BytesIO(source)) as f:
+            async def analyze():
+                f.seek(0)
+                return await self.document_analysis_client.begin_analyze_document(
+                    "prebuilt-document", document=f
+                )
 
-        text_content = []
-        tables = []
-        key_value_pairs = {}
-        
-        for page in result.pages:
-            page_text = []
-            for line in page.lines:
-                page_text.append(line.content)
-            text_content.append('\n'.join(page_text))
-
-        for table in result.tables:
-            table_data = []
-            for row_idx in range(table.row_count):
-                row_data = []
-                for col_idx in range(table.column_count):
-                    cell = next((cell for cell in table.cells 
-                               if cell.row_index == row_idx 
-                               and cell.column_index == col_idx), None)
-                    row_data.append(cell.content if cell else '')
-                table_data.append(row_data)
-            if table_data:
-                tables.append(table_data)
+            poller = await self._retry(analyze)
+            result = await poller.result()
 
-        for kv in result.key_value_pairs:
-            if kv.key and kv.value:
-                key_value_pairs[kv.key.content] = kv.value.content
+        # Walk each part of the result graph exactly once, building outputs in place
+        pages = result.pages
+        text_content = [_page_text(page) for page in pages]
+        tables = [table_data for table_data in map(_table_grid, result.tables) if table_data]
+        key_value_pairs = {
+            kv.key.content: kv.value.content
+            for kv in result.key_value_pairs
+            if kv.key and kv.value
+        }
 
         return {
             'text_content': text_content,
             'tables': tables,
             'key_value_pairs': key_value_pairs,
             'metadata': {
-                'page_count': len(result.pages),
+                'page_count': len(pages),
                 'processor': 'Azure Document Intelligence',
                 'timestamp': datetime.now().isoformat()
             }
         }
 
-    async def _extract_content_fallback(self, file_path: str) -> Dict[str, Any]:
+    async def _extract_content_fallback(self, source: PdfSource, pipeline: _UploadPipeline = None,
+                                        doc=None) -> Dict[str, Any]:
         """Extract content using PyMuPDF as fallback"""
         try:
-            # Run PyMuPDF in a thread pool to avoid blocking
+            # Run PyMuPDF on its dedicated thread to avoid blocking
             loop = asyncio.get_event_loop()
+            on_images = pipeline.put_images_threadsafe if pipeline else None
             
             async with async_timeout(self.timeout):
-                result = await loop.run_in_executor(None, self._process_with_pymupdf, file_path)
+                result = await loop.run_in_executor(FITZ_POOL, self._process_with_pymupdf, source, on_images, doc)
             
             return result
             
@@ -341,37 +522,14 @@ class PDFEnterpriseProcessor:
             logger.error(f"Error in fallback PDF processing: {str(e)}")
             raise
 
-    def _process_with_pymupdf(self, file_path: str) -> Dict[str, Any]:
-        """Synchronous PyMuPDF processing"""
-        doc = None
+    def _process_with_pymupdf(self, source: PdfSource, on_images=None, doc=None) -> Dict[str, Any]:
+        """Synchronous PyMuPDF processing; takes ownership of an already opened ``doc``"""
         try:
-            doc = fitz.open(file_path)
-            text_content = []
-            images = []
+            if doc is None:
+                doc = open_document(source)
+            text_content, images = extract_pages(doc, source, on_images)
             tables = []
             
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                text = page.get_text()
-                if text.strip():
-                    text_content.append(text)
-                
-                # Extract images
-                for img_index, img in enumerate(page.get_images(full=True)):
-                    try:
-                        xref = img[0]
-                        base_image = doc.extract_image(xref)
-                        if base_image:
-                            image_data = {
-                                'data': base_image["image"],
-                                'ext': base_image["ext"],
-                                'page': page_num + 1,
-                                'index': img_index
-                            }
-                            images.append(image_data)
-                    except Exception as img_error:
-                        logger.warning(f"Error extracting image {img_index} from page {page_num + 1}: {str(img_error)}")
-            
             return {
                 'text_content': text_content,
                 'images': images,
@@ -385,13 +543,28 @@ class PDFEnterpriseProcessor:
             
         finally:
             if doc:
-                doc.close()
+                close_document(doc)
+
+    @classmethod
+    async def close_clients(cls):
+        """Close the cached Azure clients and their HTTP sessions"""
+        clients = list(cls._client_cache.values())
+        cls._client_cache.clear()
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning(f"Error closing Azure Document Intelligence client: {str(e)}")
 
-    def _generate_document_id(self, file_path: str) -> str:
-        """Generate a unique document ID"""
+    async def _generate_document_id(self, source: PdfSource, use_fallback: bool = None) -> str:
+        """Generate a unique document ID based on file content and timestamp"""
+        if use_fallback is None:
+            use_fallback = self.use_fallback
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = os.path.basename(file_path)
-        return f"pdf_{'fallback' if self.use_fallback else 'azure'}_{filename}_{timestamp}"
+        # Hashing a large upload takes a while, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        content_hash = await loop.run_in_executor(CPU_POOL, hash_source, source)
+        return f"pdf_{'fallback' if use_fallback else 'azure'}_{content_hash}_{timestamp}"
 
     def get_supported_languages(self) -> list:
         """Return list of supported languages"""
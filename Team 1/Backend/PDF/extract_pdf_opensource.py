@@ -1,64 +1,68 @@
 # pdf_processor.py
 import logging
 import io
-import os
-import fitz  # PyMuPDF
+import asyncio
 from typing import Dict, Any, BinaryIO
 from datetime import datetime
 import pandas as pd
 import tabula  # for table extraction
-import hashlib
 import json
+import tarfile
+
+from PDF.pdf_utils import (
+    PdfSource, extract_pages, name_images, open_document, close_document, hash_source, source_size,
+    CPU_POOL, FITZ_POOL, IO_POOL
+)
+from s3.s3 import compress_for_upload
 
 logger = logging.getLogger(__name__)
 
+def _images_to_tar(images: list) -> io.BytesIO:
+    """Bundle extracted images into an uncompressed tar archive, one member per distinct image"""
+    buffer = io.BytesIO()
+    written = set()
+    with tarfile.open(fileobj=buffer, mode='w') as archive:
+        for img in images:
+            if img['name'] in written:
+                continue
+            written.add(img['name'])
+            info = tarfile.TarInfo(img['name'])
+            info.size = len(img['data'])
+            archive.addfile(info, io.BytesIO(img['data']))
+    buffer.seek(0)
+    return buffer
+
 class PDFProcessor:
     def __init__(self, storage_client=None):
         """Initialize PDFProcessor"""
         self.storage_client = storage_client
         self.base_path = "PDF/Opensource/"
 
-    def _generate_document_id(self, file_path: str) -> str:
+    async def _generate_document_id(self, source: PdfSource) -> str:
         """Generate a unique document ID based on file content and timestamp"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = os.path.basename(file_path)
-        return f"pdf_os_{filename}_{timestamp}"
+        # Hashing a large upload takes a while, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        content_hash = await loop.run_in_executor(CPU_POOL, hash_source, source)
+        return f"pdf_os_{content_hash}_{timestamp}"
 
-    async def _extract_content(self, file_path: str) -> Dict[str, Any]:
+    async def _extract_content(self, source: PdfSource) -> Dict[str, Any]:
         """Extract content from PDF using PyMuPDF"""
+        # Run PyMuPDF on its dedicated thread to avoid blocking the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(FITZ_POOL, self._extract_content_sync, source)
+
+    def _extract_content_sync(self, source: PdfSource) -> Dict[str, Any]:
+        """Synchronous PyMuPDF extraction"""
+        doc = None
         try:
-            doc = fitz.open(file_path)
+            doc = open_document(source)
             
-            text_content = []
-            images = []
+            # Extract text and images page by page
+            text_content, images = extract_pages(doc, source)
+            name_images(images, {})
             tables = []  # PyMuPDF doesn't extract tables directly
             
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                
-                # Extract text
-                text = page.get_text()
-                if text.strip():
-                    text_content.append(text)
-                
-                # Extract images
-                image_list = page.get_images(full=True)
-                for img_index, img in enumerate(image_list):
-                    try:
-                        xref = img[0]
-                        base_image = doc.extract_image(xref)
-                        if base_image:
-                            image_data = {
-                                'data': base_image["image"],
-                                'ext': base_image["ext"],
-                                'page': page_num + 1,
-                                'index': img_index
-                            }
-                            images.append(image_data)
-                    except Exception as img_error:
-                        logger.warning(f"Error extracting image {img_index} from page {page_num}: {str(img_error)}")
-                        continue
-            
             # Get document metadata
             metadata = {
                 'title': doc.metadata.get('title', ''),
@@ -66,13 +70,11 @@ class PDFProcessor:
                 'subject': doc.metadata.get('subject', ''),
                 'keywords': doc.metadata.get('keywords', ''),
                 'page_count': len(doc),
-                'file_size': os.path.getsize(file_path),
+                'file_size': source_size(source),
                 'creation_date': doc.metadata.get('creationDate', ''),
                 'modification_date': doc.metadata.get('modDate', '')
             }
             
-            doc.close()
-            
             return {
                 'text_content': text_content,
                 'images': images,
@@ -83,6 +85,9 @@ class PDFProcessor:
         except Exception as e:
             logger.error(f"Error extracting content from PDF: {str(e)}")
             raise
+        finally:
+            if doc:
+                close_document(doc)
 
     async def _store_content(self, content: Dict, doc_id: str) -> Dict[str, str]:
         """Store extracted content"""
@@ -91,34 +96,47 @@ class PDFProcessor:
             base_folder = f"{self.base_path}{doc_id}"
 
             if self.storage_client:
-                # Store text content
+                # Collect every artifact first, then upload them concurrently
+                uploads = {}
+
+                # Store text content, zstd-compressed when it is large enough to benefit
                 text_content = "\n\n".join(content['text_content'])
-                text_key = f"{base_folder}/text_content.txt"
-                self.storage_client.upload(
-                    io.BytesIO(text_content.encode('utf-8')).read(),
-                    text_key
+                text_body, text_key, text_encoding = compress_for_upload(
+                    text_content.encode('utf-8'), f"{base_folder}/text_content.txt"
                 )
-                storage_paths['text'] = text_key
+                uploads['text'] = (text_body, text_key, 'text/plain', text_encoding)
 
                 # Store metadata
-                metadata_key = f"{base_folder}/metadata.json"
                 metadata_json = json.dumps(content['metadata'])
-                self.storage_client.upload(
-                    io.BytesIO(metadata_json.encode('utf-8')).read(),
-                    metadata_key
+                uploads['metadata'] = (
+                    metadata_json.encode('utf-8'),
+                    f"{base_folder}/metadata.json",
+                    'application/json',
+                    None
                 )
-                storage_paths['metadata'] = metadata_key
 
-                # Store images
+                loop = asyncio.get_event_loop()
+
+                # Store all images as a single archive instead of one object per image
                 if content['images']:
-                    images_folder = f"{base_folder}/images"
-                    for idx, img in enumerate(content['images']):
-                        img_key = f"{images_folder}/image_{idx}.{img['ext']}"
-                        self.storage_client.upload(
-                            img['data'],
-                            img_key
-                        )
-                        storage_paths[f'image_{idx}'] = img_key
+                    uploads['images'] = (
+                        await loop.run_in_executor(CPU_POOL, _images_to_tar, content['images']),
+                        f"{base_folder}/images.tar",
+                        'application/x-tar',
+                        None
+                    )
+
+                tasks = [
+                    loop.run_in_executor(IO_POOL, self.storage_client.upload, body, key, content_type, encoding)
+                    for body, key, content_type, encoding in uploads.values()
+                ]
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+
+                for (name, (_, key, _, _)), result in zip(uploads.items(), results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Error uploading {key}: {str(result)}")
+                    else:
+                        storage_paths[name] = key
 
             return storage_paths
 
@@ -126,14 +144,14 @@ class PDFProcessor:
             logger.error(f"Error storing content: {str(e)}")
             return {}  # Return empty dict if storage fails
 
-    async def process_pdf(self, file_path: str) -> Dict[str, Any]:
-        """Process PDF file"""
+    async def process_pdf(self, source: PdfSource) -> Dict[str, Any]:
+        """Process a PDF given as a file path or as its raw bytes"""
         try:
             # Generate document ID
-            doc_id = self._generate_document_id(file_path)
+            doc_id = await self._generate_document_id(source)
             
             # Extract content
-            content = await self._extract_content(file_path)
+            content = await self._extract_content(source)
             
             # Store content if storage client is available
             storage_paths = {}
@@ -165,7 +183,8 @@ class PDFProcessor:
                     {
                         'page': img['page'],
                         'index': img['index'],
-                        'ext': img['ext']
+                        'ext': img['ext'],
+                        'name': img['name']
                     } for img in content["images"]
                 ]
             
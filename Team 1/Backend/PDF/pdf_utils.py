@@ -0,0 +1,240 @@
+# pdf_utils.py
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, List, Optional, Tuple, Union
+import fitz  # PyMuPDF
+
+logger = logging.getLogger(__name__)
+
+# PyMuPDF documents must not be shared between threads, so large PDFs are split
+# into page ranges that worker processes extract with their own document handle.
+MAX_PAGE_WORKERS = min(8, os.cpu_count() or 1)
+PARALLEL_PAGE_THRESHOLD = 32
+PAGES_PER_TASK = 16
+
+# Worker processes are started from a clean forkserver (or spawned) rather than forked
+# from this multi-threaded server, where a child could inherit a lock held by another thread.
+MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# Process-wide executors, kept apart from asyncio's default executor so long
+# extractions and bursts of uploads cannot starve each other or other await sites.
+CPU_POOL = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="pdf-cpu")
+IO_POOL = ThreadPoolExecutor(max_workers=64, thread_name_prefix="pdf-io")
+# PyMuPDF is not thread-safe and close_document shrinks its process-global store, so all
+# in-process fitz work runs on this one thread; CPU_POOL is only for work that doesn't touch fitz.
+FITZ_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-fitz")
+
+# A PDF is either a filesystem path or its raw bytes, e.g. straight from an upload
+PdfSource = Union[str, bytes]
+
+# Long-lived page worker pool, started on first use by get_page_pool
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+
+def hash_file(file_path: str) -> str:
+    """Return a short BLAKE2b content hash of a file, read through mmap"""
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.blake2b(b'', digest_size=8).hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.blake2b(mm, digest_size=8).hexdigest()
+
+
+def hash_source(source: PdfSource) -> str:
+    """Return a short BLAKE2b content hash of a PDF path or PDF bytes"""
+    if isinstance(source, str):
+        return hash_file(source)
+    return hashlib.blake2b(source, digest_size=8).hexdigest()
+
+
+def source_size(source: PdfSource) -> int:
+    """Return the size in bytes of a PDF path or PDF bytes"""
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    return len(source)
+
+
+def open_document(source: PdfSource):
+    """Open a PDF from a filesystem path or directly from memory"""
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def _page_images(doc, page_num: int, seen: Dict[int, Any]) -> List[Dict[str, Any]]:
+    """Extract the images embedded in a single page.
+
+    ``seen`` caches extracted images by xref, so an image reused across pages
+    (logos, headers) is only decoded once.
+    """
+    images = []
+
+    for img_index, img in enumerate(doc[page_num].get_images(full=True)):
+        try:
+            xref = img[0]
+            if xref not in seen:
+                seen[xref] = doc.extract_image(xref)
+            base_image = seen[xref]
+            if base_image:
+                images.append({
+                    'data': base_image["image"],
+                    'ext': base_image["ext"],
+                    'xref': xref,
+                    'page': page_num + 1,
+                    'index': img_index
+                })
+        except Exception as img_error:
+            logger.warning(f"Error extracting image {img_index} from page {page_num + 1}: {str(img_error)}")
+
+    return images
+
+
+def _process_page(doc, page_num: int, seen: Dict[int, Any]) -> Tuple[int, str, List[Dict[str, Any]]]:
+    """Extract text and images from a single page"""
+    return page_num, doc[page_num].get_text(), _page_images(doc, page_num, seen)
+
+
+def get_page_pool() -> ProcessPoolExecutor:
+    """Return the process-wide page worker pool, starting it on first use"""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ProcessPoolExecutor(max_workers=MAX_PAGE_WORKERS, mp_context=MP_CONTEXT)
+        return _page_pool
+
+
+def shutdown_page_pool():
+    """Stop the page worker processes"""
+    global _page_pool
+    with _page_pool_lock:
+        pool, _page_pool = _page_pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+@contextmanager
+def _source_path(source: PdfSource):
+    """Yield a path worker processes can open; in-memory PDFs are spilled to a temp file once"""
+    if isinstance(source, str):
+        yield source
+        return
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(source)
+    try:
+        yield f.name
+    finally:
+        os.unlink(f.name)
+
+
+def _process_page_range(path: str, start: int, stop: int) -> List[Tuple[int, str, List[Dict[str, Any]]]]:
+    """Extract a range of pages in a worker process"""
+    doc = open_document(path)
+    try:
+        seen = {}
+        return [_process_page(doc, page_num, seen) for page_num in range(start, stop)]
+    finally:
+        close_document(doc)
+
+
+def name_images(images: List[Dict[str, Any]], names: Dict[Any, str]):
+    """Set each image's ``name`` from the first page it appears on and its PDF xref.
+
+    ``names`` maps xrefs to the names already given, so every occurrence of an image
+    repeated across pages (logos, headers) shares one name and is stored once.
+    """
+    for img in images:
+        xref = img.get('xref')
+        ident = xref if xref is not None else (img['page'], img['index'])
+        if ident not in names:
+            if xref is not None:
+                names[ident] = f"page{img['page']}_xref{xref}.{img['ext']}"
+            else:
+                names[ident] = f"page{img['page']}_index{img['index']}.{img['ext']}"
+        img['name'] = names[ident]
+
+
+def close_document(doc):
+    """Close a document and release MuPDF's shared store cache"""
+    doc.close()
+    fitz.TOOLS.store_shrink(100)
+
+
+def extract_images(doc) -> List[Dict[str, Any]]:
+    """Extract the images of every page of an open document, in page order"""
+    seen = {}
+    return [img for page_num in range(len(doc)) for img in _page_images(doc, page_num, seen)]
+
+
+def extract_pages(
+    doc,
+    source: PdfSource,
+    on_images: Optional[Callable[[List[Dict[str, Any]]], None]] = None
+) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Extract text and images from every page of an open document, in page order.
+
+    ``on_images`` is called with each batch of images as soon as its pages are done,
+    so callers can start uploading them before the whole document is extracted.
+    """
+    page_count = len(doc)
+
+    if page_count < PARALLEL_PAGE_THRESHOLD or MAX_PAGE_WORKERS < 2:
+        results = []
+        seen = {}
+        for page_num in range(page_count):
+            results.append(_process_page(doc, page_num, seen))
+            if on_images and results[-1][2]:
+                on_images(results[-1][2])
+    else:
+        pages = {}
+
+        def collect(future):
+            page_results = future.result()
+            pages.update((result[0], result) for result in page_results)
+            if on_images:
+                range_images = [img for _, _, page_images in page_results for img in page_images]
+                if range_images:
+                    on_images(range_images)
+
+        pool = get_page_pool()
+        pending = set()
+        with _source_path(source) as path:
+            try:
+                # Only keep a bounded number of ranges in flight to cap memory on huge PDFs
+                for start in range(0, page_count, PAGES_PER_TASK):
+                    pending.add(pool.submit(_process_page_range, path, start, min(start + PAGES_PER_TASK, page_count)))
+                    if len(pending) >= MAX_PAGE_WORKERS * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            collect(future)
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+            except BrokenProcessPool:
+                # A dead worker breaks the whole pool; start a fresh one for the next PDF
+                shutdown_page_pool()
+                raise
+            finally:
+                for future in pending:
+                    future.cancel()
+        results = [pages[page_num] for page_num in range(page_count)]
+
+    text_content = []
+    images = []
+    for _, text, page_images in results:
+        if text.strip():
+            text_content.append(text)
+        images.extend(page_images)
+
+    return text_content, images
@@ -5,13 +5,13 @@ from bs4 import BeautifulSoup
 from datetime import datetime
 from typing import Dict, Any
 import logging
-import hashlib
-import json
+import orjson
 import os
-from urllib.parse import urljoin
-import io
 import certifi
 
+from s3.s3 import compress_for_upload
+from Web.web_utils import TEXT_TAGS, hash_url, url_resolver
+
 logger = logging.getLogger(__name__)
 
 class WebEnterpriseProcessor:
@@ -20,11 +20,41 @@ class WebEnterpriseProcessor:
         self.storage_client = storage_client
         self.base_path = "Web/Enterprise/"
         self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Accept-Encoding': 'gzip, deflate, br'
         }
         # Initialize Diffbot token
         self.diffbot_token = os.getenv("DIFFBOT_TOKEN")
         self.diffbot_api_url = "https://api.diffbot.com/v3/article"
+        # Create SSL context that verifies certificates
+        self.ssl_context = ssl.create_default_context(cafile=certifi.where())
+        # Verification can only be switched off explicitly, e.g. for test hosts with self-signed certificates
+        if os.getenv("WEB_SSL_VERIFY", "true").lower() == "false":
+            logger.warning("SSL certificate verification disabled by WEB_SSL_VERIFY")
+            self.ssl_context.check_hostname = False
+            self.ssl_context.verify_mode = ssl.CERT_NONE
+        self._session = None
+
+    async def startup(self):
+        """Create the HTTP session shared by Diffbot and fallback requests"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, ssl=self.ssl_context)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=30),
+                headers=self.headers
+            )
+
+    async def shutdown(self):
+        """Close the shared HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            await self.startup()
+        return self._session
 
     async def process_webpage(self, url: str) -> Dict[str, Any]:
         """Process webpage using Diffbot or fallback to BeautifulSoup"""
@@ -69,108 +99,90 @@ class WebEnterpriseProcessor:
 
     async def _extract_content_diffbot(self, url: str) -> Dict[str, Any]:
         """Extract content using Diffbot API"""
-        # Create SSL context that verifies certificates
-        ssl_context = ssl.create_default_context()
-        
-        # Create TCP connector with SSL context
-        connector = aiohttp.TCPConnector(ssl=ssl_context)
-        timeout = aiohttp.ClientTimeout(total=30)
-        
-        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-            try:
-                params = {
-                    'token': self.diffbot_token,
-                    'url': url,
-                    'discussion': 'false'
-                }
+        session = await self._get_session()
+        try:
+            params = {
+                'token': self.diffbot_token,
+                'url': url,
+                'discussion': 'false'
+            }
+            
+            async with session.get(self.diffbot_api_url, params=params) as response:
+                response.raise_for_status()
+                data = await response.json()
                 
-                async with session.get(self.diffbot_api_url, params=params) as response:
-                    response.raise_for_status()
-                    data = await response.json()
-                    
-                    if 'objects' not in data or not data['objects']:
-                        logger.warning("No content extracted by Diffbot, falling back to BeautifulSoup")
-                        return await self._extract_content_fallback(url)
-                        
-                    article = data['objects'][0]
+                if 'objects' not in data or not data['objects']:
+                    logger.warning("No content extracted by Diffbot, falling back to BeautifulSoup")
+                    return await self._extract_content_fallback(url)
                     
-                    return {
-                        'text': article.get('text', ''),
-                        'title': article.get('title', ''),
-                        'images': article.get('images', []),
-                        'links': article.get('links', []),
-                        'html': article.get('html', ''),
-                        'author': article.get('author', ''),
-                        'date': article.get('date', ''),
-                        'siteName': article.get('siteName', '')
-                    }
-                    
-            except aiohttp.ClientError as e:
-                logger.warning(f"Diffbot API error: {str(e)}, falling back to BeautifulSoup")
-                return await self._extract_content_fallback(url)
-            except Exception as e:
-                logger.error(f"Error with Diffbot API: {str(e)}")
-                raise
+                article = data['objects'][0]
+                
+                return {
+                    'text': article.get('text', ''),
+                    'title': article.get('title', ''),
+                    'images': article.get('images', []),
+                    'links': article.get('links', []),
+                    'html': article.get('html', ''),
+                    'author': article.get('author', ''),
+                    'date': article.get('date', ''),
+                    'siteName': article.get('siteName', '')
+                }
+                
+        except aiohttp.ClientError as e:
+            logger.warning(f"Diffbot API error: {str(e)}, falling back to BeautifulSoup")
+            return await self._extract_content_fallback(url)
+        except Exception as e:
+            logger.error(f"Error with Diffbot API: {str(e)}")
+            raise
 
     async def _extract_content_fallback(self, url: str) -> Dict[str, Any]:
         """Fallback extraction using BeautifulSoup"""
-        # Create SSL context that verifies certificates
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        
-        # Create TCP connector with SSL context
-        connector = aiohttp.TCPConnector(ssl=ssl_context)
-        timeout = aiohttp.ClientTimeout(total=30)
-        
-        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-            try:
-                async with session.get(url, headers=self.headers) as response:
-                    response.raise_for_status()
-                    html = await response.text()
-                
-                soup = BeautifulSoup(html, 'html.parser')
-                
-                text_content = []
-                for p in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-                    text = p.get_text().strip()
+        session = await self._get_session()
+        try:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                html = await response.text()
+            
+            soup = BeautifulSoup(html, 'lxml')
+            
+            resolve = url_resolver(url)
+
+            # Collect text, images and links in a single walk over the tags
+            text_content = []
+            images = []
+            links = []
+            for tag in soup.find_all(True):
+                if tag.name in TEXT_TAGS:
+                    text = tag.get_text().strip()
                     if text:
                         text_content.append(text)
-
-                images = []
-                for img in soup.find_all('img'):
-                    src = img.get('src')
+                elif tag.name == 'img':
+                    src = tag.get('src')
                     if src:
-                        if not src.startswith(('http://', 'https://')):
-                            src = urljoin(url, src)
                         images.append({
-                            'url': src,
-                            'alt': img.get('alt', ''),
-                            'title': img.get('title', '')
+                            'url': resolve(src),
+                            'alt': tag.get('alt', ''),
+                            'title': tag.get('title', '')
                         })
-
-                links = []
-                for link in soup.find_all('a'):
-                    href = link.get('href')
+                elif tag.name == 'a':
+                    href = tag.get('href')
                     if href:
-                        if not href.startswith(('http://', 'https://')):
-                            href = urljoin(url, href)
                         links.append({
-                            'url': href,
-                            'text': link.get_text().strip()
+                            'url': resolve(href),
+                            'text': tag.get_text().strip()
                         })
 
-                return {
-                    'text': '\n'.join(text_content),
-                    'title': soup.title.string if soup.title else '',
-                    'images': images,
-                    'links': links,
-                    'html': str(soup)
-                }
+            return {
+                'text': '\n'.join(text_content),
+                'title': soup.title.string if soup.title else '',
+                'images': images,
+                'links': links,
+                'html': str(soup)
+            }
 
-            except Exception as e:
-                logger.error(f"Error in fallback extraction: {str(e)}")
-                raise
+        except Exception as e:
+            logger.error(f"Error in fallback extraction: {str(e)}")
+            raise
 
     async def _store_content(self, content: Dict, doc_id: str) -> Dict[str, str]:
         """Store extracted content"""
@@ -179,48 +191,34 @@ class WebEnterpriseProcessor:
             base_folder = f"{self.base_path}{doc_id}"
 
             if self.storage_client:
-                loop = asyncio.get_event_loop()
-
-                # Store text content
-                text_key = f"{base_folder}/content.txt"
-                await loop.run_in_executor(
-                    None,
-                    lambda: self.storage_client.upload(
-                        io.BytesIO(content['text'].encode('utf-8')),
-                        text_key,
-                        'text/plain'
-                    )
-                )
-                storage_paths['text'] = text_key
-
-                # Store HTML content
-                html_key = f"{base_folder}/content.html"
-                await loop.run_in_executor(
-                    None,
-                    lambda: self.storage_client.upload(
-                        io.BytesIO(content['html'].encode('utf-8')),
-                        html_key,
-                        'text/html'
-                    )
-                )
-                storage_paths['html'] = html_key
-
-                # Store metadata
                 metadata = {
                     'title': content['title'],
                     'image_count': len(content['images']),
                     'link_count': len(content['links'])
                 }
-                metadata_key = f"{base_folder}/metadata.json"
-                await loop.run_in_executor(
-                    None,
-                    lambda: self.storage_client.upload(
-                        io.BytesIO(json.dumps(metadata).encode('utf-8')),
-                        metadata_key,
-                        'application/json'
-                    )
+                text_body, text_key, text_encoding = compress_for_upload(
+                    content['text'].encode('utf-8'), f"{base_folder}/content.txt"
+                )
+                html_body, html_key, html_encoding = compress_for_upload(
+                    content['html'].encode('utf-8'), f"{base_folder}/content.html"
+                )
+                uploads = {
+                    'text': (text_body, text_key, 'text/plain', text_encoding),
+                    'html': (html_body, html_key, 'text/html', html_encoding),
+                    'metadata': (orjson.dumps(metadata), f"{base_folder}/metadata.json", 'application/json', None)
+                }
+
+                # The objects are independent, so upload them concurrently and keep whichever succeed
+                results = await asyncio.gather(
+                    *(self.storage_client.upload_async(*upload) for upload in uploads.values()),
+                    return_exceptions=True
                 )
-                storage_paths['metadata'] = metadata_key
+
+                for (name, (_, key, _, _)), result in zip(uploads.items(), results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Error uploading {key}: {str(result)}")
+                    else:
+                        storage_paths[name] = key
 
             return storage_paths
 
@@ -231,5 +229,5 @@ class WebEnterpriseProcessor:
     def _generate_document_id(self, url: str) -> str:
         """Generate a unique document ID"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        url_hash = hashlib.md5(url.encode()).hexdigest()[:8]
+        url_hash = hash_url(url)
         return f"web_enterprise_{url_hash}_{timestamp}"
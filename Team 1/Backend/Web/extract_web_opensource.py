@@ -1,48 +1,263 @@
 import aiohttp
 import asyncio
-from bs4 import BeautifulSoup
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+from fastapi import HTTPException
+from lxml import etree
+from lxml.html import HtmlElementClassLookup
+from lxml.etree import XPath
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import logging
-import hashlib
 import ssl
 import certifi
 import re
-from urllib.parse import urlparse
-import io
-import json
-from urllib.parse import urljoin
+import orjson
 import os
 
+from s3.s3 import compress_for_upload
+from Web.web_utils import TEXT_TAGS, hash_url, url_resolver
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Elements whose text is read when they end, so their subtrees must be kept until then
+CAPTURE_TAGS = TEXT_TAGS | {'table', 'a', 'title'}
+
+_WS = re.compile(r'\s+')
+_ROW_XP = XPath(".//tr")
+_CELL_XP = XPath(".//td|.//th")
+
+STREAM_CHUNK_SIZE = 32 * 1024
+MAX_HTML_BYTES = 20 * 1024 * 1024
+# Pages are parsed inline while they stream in; once this many (decompressed) bytes have
+# arrived, the rest of the page is buffered and the whole page is parsed in the parse pool
+POOL_PARSE_MIN_BYTES = 512 * 1024
+
+# Per-URL cache of extracted content, revalidated with the ETag/Last-Modified the server sent
+CACHE_MAX_ENTRIES = 256
+CACHE_TTL_SECONDS = 3600
+
+def _element_text(element) -> str:
+    """Text of an element's subtree with whitespace runs collapsed, in one pass over the string"""
+    return _WS.sub(' ', element.text_content()).strip()
+
+class _PageExtractor:
+    """Extract content from HTML fed in chunks, releasing each subtree once it is read"""
+
+    def __init__(self, url: str, charset: Optional[str] = None):
+        self.url = url
+        self._resolve = url_resolver(url)
+        self._parser = etree.HTMLPullParser(events=('start', 'end'), encoding=charset)
+        self._parser.set_element_class_lookup(HtmlElementClassLookup())
+        self._fed = False
+        self._capturing = 0
+        self._open_tables = []
+        self.text_content = []
+        self.tables = []
+        self.images = []
+        self.links = []
+        self.meta_by_name = {}
+        self.title = None
+
+    def feed(self, chunk: bytes):
+        """Parse the next chunk of the page and handle the elements it completed"""
+        if chunk:
+            self._fed = True
+            self._parser.feed(chunk)
+            self._handle_events()
+
+    def close(self) -> Dict[str, Any]:
+        """Finish parsing and return the extracted content"""
+        if self._fed:
+            try:
+                self._parser.close()
+            except etree.XMLSyntaxError as e:
+                logger.warning(f"Error finishing HTML parse for {self.url}: {str(e)}")
+            self._handle_events()
+
+        return {
+            'text_content': self.text_content,
+            'tables': [table for table in self.tables if table],
+            'images': self.images,
+            'links': self.links,
+            'metadata': {
+                'title': self.title or '',
+                'url': self.url,
+                'description': self.meta_by_name.get('description', ''),
+                'keywords': self.meta_by_name.get('keywords', '')
+            }
+        }
+
+    def _handle_events(self):
+        for event, tag in self._parser.read_events():
+            name = tag.tag
+            if event == 'start':
+                if name in CAPTURE_TAGS:
+                    self._capturing += 1
+                if name == 'table':
+                    # Reserve the table's slot now so nested tables keep document order
+                    self._open_tables.append(len(self.tables))
+                    self.tables.append(None)
+                continue
+
+            if name in CAPTURE_TAGS:
+                self._capturing -= 1
+
+            if name in TEXT_TAGS:
+                text = _element_text(tag)
+                if text:
+                    self.text_content.append(text)
+            elif name == 'table':
+                table_data = []
+                for row in _ROW_XP(tag):
+                    row_data = [_element_text(cell) for cell in _CELL_XP(row)]
+                    if row_data:
+                        table_data.append(row_data)
+                self.tables[self._open_tables.pop()] = table_data
+            elif name == 'img':
+                src = tag.get('src')
+                if src:
+                    self.images.append({
+                        'url': self._resolve(src),
+                        'alt': tag.get('alt', ''),
+                        'title': tag.get('title', '')
+                    })
+            elif name == 'a':
+                href = tag.get('href')
+                if href:
+                    self.links.append({
+                        'url': self._resolve(href),
+                        'text': _element_text(tag)
+                    })
+            elif name == 'meta':
+                # Collected once per page; names are case-insensitive (<meta name="Description">)
+                meta_name = tag.get('name', '').lower()
+                if meta_name and meta_name not in self.meta_by_name:
+                    self.meta_by_name[meta_name] = tag.get('content', '')
+            elif name == 'title' and self.title is None:
+                self.title = _element_text(tag)
+
+            # Nothing still open needs this subtree, so free it and its finished siblings
+            if not self._capturing:
+                tag.clear()
+                parent = tag.getparent()
+                if parent is not None:
+                    while tag.getprevious() is not None:
+                        del parent[0]
+
+def parse_html_bytes(html_bytes: bytes, url: str, charset: Optional[str] = None) -> Dict[str, Any]:
+    """Extract content from a complete HTML document; picklable for use in a process pool"""
+    extractor = _PageExtractor(url, charset)
+    extractor.feed(html_bytes)
+    return extractor.close()
+
 class WebProcessor:
     def __init__(self, storage_client=None):
         """Initialize WebProcessor"""
         self.storage_client = storage_client
         self.base_path = "Web/Opensource/"
         self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Accept-Encoding': 'gzip, deflate, br'
         }
         # Create SSL context
         self.ssl_context = ssl.create_default_context(cafile=certifi.where())
+        # Verification can only be switched off explicitly, e.g. for test hosts with self-signed certificates
+        if os.getenv("WEB_SSL_VERIFY", "true").lower() == "false":
+            logger.warning("SSL certificate verification disabled by WEB_SSL_VERIFY")
+            self.ssl_context.check_hostname = False
+            self.ssl_context.verify_mode = ssl.CERT_NONE
+        self._session = None
+        self._cache = OrderedDict()
+        self._parse_pool = None
+
+    async def startup(self, parse_pool: Optional[Executor] = None):
+        """Create the HTTP session shared by all page fetches.
+
+        With ``parse_pool``, pages of at least POOL_PARSE_MIN_BYTES are parsed in that (process)
+        pool instead of on the event loop.
+        """
+        if parse_pool is not None:
+            self._parse_pool = parse_pool
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=20,
+                ttl_dns_cache=300,
+                ssl=self.ssl_context
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=30),
+                headers=self.headers
+            )
+
+    async def shutdown(self):
+        """Close the shared HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._parse_pool = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            await self.startup()
+        return self._session
+
+    def _cache_get(self, url: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for a URL if it has not expired"""
+        entry = self._cache.get(url)
+        if entry is None:
+            return None
+        if time.monotonic() - entry['cached_at'] > CACHE_TTL_SECONDS:
+            del self._cache[url]
+            return None
+        self._cache.move_to_end(url)
+        return entry
+
+    def _cache_put(self, url: str, entry: Dict[str, Any]):
+        """Cache an entry for a URL, evicting the least recently used ones"""
+        entry['cached_at'] = time.monotonic()
+        self._cache[url] = entry
+        self._cache.move_to_end(url)
+        while len(self._cache) > CACHE_MAX_ENTRIES:
+            self._cache.popitem(last=False)
 
     async def process_webpage(self, url: str) -> Dict[str, Any]:
-        """Process webpage using BeautifulSoup"""
+        """Process webpage using lxml"""
         try:
-            # Generate document ID
-            doc_id = self._generate_document_id(url)
             timestamp = datetime.now().isoformat()
+            cached = self._cache_get(url)
             
-            # Extract content
-            content = await self._extract_content(url)
+            # Extract content; None means the cached copy is still current
+            content = await self._extract_content(url, cached['validators'] if cached else None)
             
-            # Store content if storage client is available
-            storage_paths = {}
-            if self.storage_client:
-                storage_paths = await self._store_content(content, doc_id)
+            if content is None:
+                logger.info(f"Webpage not modified, reusing cached content: {url}")
+                doc_id = cached['document_id']
+                content = cached['content']
+                storage_paths = cached['storage_paths']
+            else:
+                # Generate document ID
+                doc_id = self._generate_document_id(url)
+                
+                # Store content if storage client is available
+                storage_paths = {}
+                if self.storage_client:
+                    storage_paths = await self._store_content(content, doc_id)
+                
+                # Don't cache pages whose upload failed, so the next request stores them again
+                validators = content.pop('validators')
+                if validators and (storage_paths or not self.storage_client):
+                    self._cache_put(url, {
+                        'validators': validators,
+                        'document_id': doc_id,
+                        'content': content,
+                        'storage_paths': storage_paths
+                    })
             
             return {
                 "status": "success",
@@ -61,7 +276,7 @@ class WebProcessor:
                     "description": content["metadata"].get("description", ""),
                     "keywords": content["metadata"].get("keywords", ""),
                     "storage_paths": storage_paths,
-                    "processor": "BeautifulSoup",
+                    "processor": "lxml",
                     "timestamp": timestamp
                 }
             }
@@ -73,86 +288,80 @@ class WebProcessor:
     def _generate_document_id(self, url: str) -> str:
         """Generate a unique document ID based on URL and timestamp"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        url_hash = hashlib.md5(url.encode()).hexdigest()[:8]
+        url_hash = hash_url(url)
         return f"web_os_{url_hash}_{timestamp}"
 
-    async def _extract_content(self, url: str) -> Dict[str, Any]:
-        """Extract content using BeautifulSoup"""
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        
-        timeout = aiohttp.ClientTimeout(total=30)
-        connector = aiohttp.TCPConnector(ssl=ssl_context)
-        
+    async def _extract_content(self, url: str, validators: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
+        """Extract content using lxml, or return None if the page is unchanged since ``validators``"""
         try:
-            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-                async with session.get(url, headers=self.headers) as response:
-                    if response.status != 200:
-                        raise Exception(f"HTTP Error {response.status}: {response.reason}")
-                    html = await response.text()
+            headers = {}
+            if validators:
+                if 'etag' in validators:
+                    headers['If-None-Match'] = validators['etag']
+                if 'last_modified' in validators:
+                    headers['If-Modified-Since'] = validators['last_modified']
 
-                soup = BeautifulSoup(html, 'html.parser')
-                
-                # Extract text content
-                text_content = []
-                for p in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-                    text = p.get_text().strip()
-                    if text:
-                        text_content.append(text)
-                
-                # Extract tables
-                tables = []
-                for table in soup.find_all('table'):
-                    table_data = []
-                    for row in table.find_all('tr'):
-                        row_data = [cell.get_text().strip() for cell in row.find_all(['td', 'th'])]
-                        if row_data:
-                            table_data.append(row_data)
-                    if table_data:
-                        tables.append(table_data)
-                
-                # Extract images
-                images = []
-                for img in soup.find_all('img'):
-                    src = img.get('src')
-                    if src:
-                        if not src.startswith(('http://', 'https://')):
-                            src = urljoin(url, src)
-                        images.append({
-                            'url': src,
-                            'alt': img.get('alt', ''),
-                            'title': img.get('title', '')
-                        })
-                
-                # Extract links
-                links = []
-                for link in soup.find_all('a'):
-                    href = link.get('href')
-                    if href:
-                        if not href.startswith(('http://', 'https://')):
-                            href = urljoin(url, href)
-                        links.append({
-                            'url': href,
-                            'text': link.get_text().strip()
-                        })
-                
-                # Extract metadata
-                metadata = {
-                    'title': soup.title.string if soup.title else '',
-                    'url': url,
-                    'description': soup.find('meta', {'name': 'description'})['content'] if soup.find('meta', {'name': 'description'}) else '',
-                    'keywords': soup.find('meta', {'name': 'keywords'})['content'] if soup.find('meta', {'name': 'keywords'}) else ''
-                }
-                
-                return {
-                    'text_content': text_content,
-                    'tables': tables,
-                    'images': images,
-                    'links': links,
-                    'metadata': metadata
-                }
-                
+            session = await self._get_session()
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and validators:
+                    return None
+                if response.status != 200:
+                    raise Exception(f"HTTP Error {response.status}: {response.reason}")
+
+                response_validators = {}
+                if 'ETag' in response.headers:
+                    response_validators['etag'] = response.headers['ETag']
+                if 'Last-Modified' in response.headers:
+                    response_validators['last_modified'] = response.headers['Last-Modified']
+
+                # Reject non-HTML and oversized responses from their headers, before reading the body
+                # Media types are case-insensitive, e.g. Text/HTML
+                content_type = response.headers.get('Content-Type', '').lower()
+                if content_type and 'html' not in content_type and 'xml' not in content_type:
+                    raise HTTPException(
+                        status_code=415,
+                        detail=f"Unsupported content type: {content_type}"
+                    )
+                if (response.content_length or 0) > MAX_HTML_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Webpage exceeds {MAX_HTML_BYTES} bytes"
+                    )
+
+                charset = response.charset
+                # Parse while the body streams in. With a parse pool the body is buffered as well,
+                # since the pool needs the whole page if it turns out to be large. Content-Length
+                # is the compressed size, or missing, so decide on the bytes actually received.
+                chunks = []
+                keep_chunks = self._parse_pool is not None
+                extractor = _PageExtractor(url, charset)
+                received = 0
+                async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    # Content-Length may be missing or wrong, so enforce the limit on what actually arrives
+                    received += len(chunk)
+                    if received > MAX_HTML_BYTES:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"Webpage exceeds {MAX_HTML_BYTES} bytes"
+                        )
+                    if keep_chunks:
+                        chunks.append(chunk)
+                    if extractor is not None:
+                        if keep_chunks and received >= POOL_PARSE_MIN_BYTES:
+                            # Large page: stop parsing on the event loop and hand it to the pool instead
+                            extractor = None
+                        else:
+                            extractor.feed(chunk)
+
+            if extractor is None:
+                # Parsing is CPU-bound; run it on another core so the event loop keeps serving I/O
+                loop = asyncio.get_running_loop()
+                content = await loop.run_in_executor(self._parse_pool, parse_html_bytes, b''.join(chunks), url, charset)
+            else:
+                content = extractor.close()
+            content['validators'] = response_validators
+            return content
+            
         except Exception as e:
             logger.error(f"Error extracting content from webpage: {str(e)}", exc_info=True)
             raise
@@ -164,23 +373,26 @@ class WebProcessor:
             base_folder = f"{self.base_path}{doc_id}"
 
             if self.storage_client:
-                # Store text content
                 text_content = "\n\n".join(content['text_content'])
-                text_key = f"{base_folder}/text_content.txt"
-                self.storage_client.upload(
-                    io.BytesIO(text_content.encode('utf-8')).read(),
-                    text_key
+                text_body, text_key, text_encoding = compress_for_upload(
+                    text_content.encode('utf-8'), f"{base_folder}/text_content.txt"
                 )
-                storage_paths['text'] = text_key
-
-                # Store metadata
-                metadata_key = f"{base_folder}/metadata.json"
-                metadata_json = json.dumps(content['metadata'])
-                self.storage_client.upload(
-                    io.BytesIO(metadata_json.encode('utf-8')).read(),
-                    metadata_key
+                uploads = {
+                    'text': (text_body, text_key, 'text/plain', text_encoding),
+                    'metadata': (orjson.dumps(content['metadata']), f"{base_folder}/metadata.json", 'application/json', None)
+                }
+
+                # Upload text and metadata concurrently and keep whichever succeed
+                results = await asyncio.gather(
+                    *(self.storage_client.upload_async(*upload) for upload in uploads.values()),
+                    return_exceptions=True
                 )
-                storage_paths['metadata'] = metadata_key
+
+                for (name, (_, key, _, _)), result in zip(uploads.items(), results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Error uploading {key}: {str(result)}")
+                    else:
+                        storage_paths[name] = key
 
             return storage_paths
 
@@ -0,0 +1,32 @@
+# web_utils.py
+import hashlib
+from functools import lru_cache
+from typing import Callable
+from urllib.parse import urljoin, urlparse
+
+# Tags whose text makes up a page's main content
+TEXT_TAGS = frozenset(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+
+
+@lru_cache(maxsize=1024)
+def hash_url(url: str) -> str:
+    """Short BLAKE2b hash of a URL, memoized for repeat requests"""
+    return hashlib.blake2b(url.encode(), digest_size=4).hexdigest()
+
+
+def url_resolver(url: str) -> Callable[[str], str]:
+    """Build a resolver for a page's links that only falls back to urljoin for relative paths"""
+    parsed = urlparse(url)
+    scheme = parsed.scheme
+    origin = f"{parsed.scheme}://{parsed.netloc}"
+
+    def resolve(ref: str) -> str:
+        if ref.startswith(('http://', 'https://')):
+            return ref
+        if ref.startswith('//'):
+            return f"{scheme}:{ref}"
+        if ref.startswith('/'):
+            return origin + ref
+        return urljoin(url, ref)
+
+    return resolve
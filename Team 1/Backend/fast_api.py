@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, HttpUrl
 from typing import Dict, Any, List
@@ -10,13 +10,14 @@ import io
 import os
 import httpx
 import asyncio
-import tempfile
 from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
 
 from PDF.extract_pdf_opensource import PDFProcessor
 from PDF.extract_pdf_enterprise import PDFEnterpriseProcessor
 from Web.extract_web_opensource import WebProcessor
 from Web.extract_web_enterprise import WebEnterpriseProcessor
+from PDF.pdf_utils import MP_CONTEXT, shutdown_page_pool
 from s3.s3 import StorageHandler
 
 # Load environment variables
@@ -26,23 +27,61 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize storage
-try:
-    storage = StorageHandler(
-        bucket_name=os.getenv("AWS_BUCKET_NAME"),
-        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        region_name=os.getenv("AWS_REGION", "us-east-1")
-    )
-except Exception as e:
-    logger.warning(f"Failed to initialize S3 storage: {str(e)}")
-    storage = None
-
-# Initialize processors
-pdf_processor_os = PDFProcessor(storage_client=storage)
-pdf_processor_enterprise = PDFEnterpriseProcessor(storage_client=storage)
-web_processor_os = WebProcessor()
-web_processor_enterprise = WebEnterpriseProcessor(storage_client=storage)
+def create_storage() -> StorageHandler:
+    """Initialize storage, or return None if S3 is not configured"""
+    try:
+        return StorageHandler(
+            bucket_name=os.getenv("AWS_BUCKET_NAME"),
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            region_name=os.getenv("AWS_REGION", "us-east-1")
+        )
+    except Exception as e:
+        logger.warning(f"Failed to initialize S3 storage: {str(e)}")
+        return None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the clients shared by all requests at startup and close them on shutdown"""
+    state = app.state
+    state.storage = create_storage()
+    if state.storage:
+        await state.storage.startup()
+
+    # Worker processes for HTML parsing, started from a forkserver rather than forked from this threaded server
+    state.parse_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=MP_CONTEXT)
+
+    # Initialize processors
+    state.pdf_processor_os = PDFProcessor(storage_client=state.storage)
+    state.pdf_processor_enterprise = PDFEnterpriseProcessor(storage_client=state.storage)
+    state.web_processor_os = WebProcessor()
+    state.web_processor_enterprise = WebEnterpriseProcessor(storage_client=state.storage)
+    await state.web_processor_os.startup(state.parse_pool)
+    await state.web_processor_enterprise.startup()
+
+    try:
+        yield
+    finally:
+        await PDFEnterpriseProcessor.close_clients()
+        await state.web_processor_os.shutdown()
+        await state.web_processor_enterprise.shutdown()
+        if state.storage:
+            await state.storage.shutdown()
+        state.parse_pool.shutdown()
+        shutdown_page_pool()
+
+# Dependencies handing the shared processors to the endpoints
+def get_pdf_processor_os(request: Request) -> PDFProcessor:
+    return request.app.state.pdf_processor_os
+
+def get_pdf_processor_enterprise(request: Request) -> PDFEnterpriseProcessor:
+    return request.app.state.pdf_processor_enterprise
+
+def get_web_processor_os(request: Request) -> WebProcessor:
+    return request.app.state.web_processor_os
+
+def get_web_processor_enterprise(request: Request) -> WebEnterpriseProcessor:
+    return request.app.state.web_processor_enterprise
 
 # Pydantic models
 class WebsiteRequest(BaseModel):
@@ -63,7 +102,8 @@ class URLInput(BaseModel):
 app = FastAPI(
     title="Document Processing API",
     description="API for processing documents",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -133,7 +173,10 @@ async def process_pdf(file: UploadFile) -> Dict[str, Any]:
 
 # Opensource PDF endpoint
 @os_router.post("/process-pdf", response_model=ProcessingResponse)
-async def process_pdf_opensource(file: UploadFile = File(...)) -> Dict[str, Any]:
+async def process_pdf_opensource(
+    file: UploadFile = File(...),
+    pdf_processor_os: PDFProcessor = Depends(get_pdf_processor_os)
+) -> Dict[str, Any]:
     """Process PDF using opensource service (PyMuPDF)"""
     if not file.content_type == "application/pdf":
         raise HTTPException(
@@ -142,36 +185,20 @@ async def process_pdf_opensource(file: UploadFile = File(...)) -> Dict[str, Any]
         )
 
     try:
-        # Create a temporary file to store the uploaded PDF
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            # Read the file in chunks to handle large files
-            chunk_size = 1024 * 1024  # 1MB chunks
-            while chunk := await file.read(chunk_size):
-                temp_file.write(chunk)
-            temp_file_path = temp_file.name
-
-        try:
-            # Initialize the PDF processor
-            processor = PDFProcessor(storage_client=storage)
-
-            # Process the PDF file
-            result = await processor.process_pdf(temp_file_path)
-
-            return {
-                "status": "success",
-                "message": "PDF processed successfully",
-                "document_id": result.get("document_id", ""),
-                "timestamp": result.get("timestamp", ""),
-                "content": result.get("content", {}),
-                "metadata": result.get("metadata", {})
-            }
+        # UploadFile is already spooled, so read it once instead of copying it to another temp file
+        content = await file.read()
 
-        finally:
-            # Clean up the temporary file
-            try:
-                os.unlink(temp_file_path)
-            except Exception as e:
-                logger.warning(f"Error removing temporary file: {str(e)}")
+        # Process the PDF straight from memory
+        result = await pdf_processor_os.process_pdf(content)
+
+        return {
+            "status": "success",
+            "message": "PDF processed successfully",
+            "document_id": result.get("document_id", ""),
+            "timestamp": result.get("timestamp", ""),
+            "content": result.get("content", {}),
+            "metadata": result.get("metadata", {})
+        }
 
     except Exception as e:
         logger.error(f"Error processing PDF: {str(e)}", exc_info=True)
@@ -184,7 +211,10 @@ async def process_pdf_opensource(file: UploadFile = File(...)) -> Dict[str, Any]
 
 # Enterprise PDF endpoint
 @enterprise_router.post("/process-pdf")
-async def process_pdf_enterprise(file: UploadFile = File(...)) -> Dict[str, Any]:
+async def process_pdf_enterprise(
+    file: UploadFile = File(...),
+    pdf_processor_enterprise: PDFEnterpriseProcessor = Depends(get_pdf_processor_enterprise)
+) -> Dict[str, Any]:
     """Process PDF using enterprise service"""
     if not file.content_type == "application/pdf":
         raise HTTPException(
@@ -193,40 +223,26 @@ async def process_pdf_enterprise(file: UploadFile = File(...)) -> Dict[str, Any]
         )
 
     try:
-        # Create a temporary file to store the uploaded PDF
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            # Read the file in chunks to handle large files
-            chunk_size = 1024 * 1024  # 1MB chunks
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-
-        try:
-            # Process the PDF file
-            processor = PDFEnterpriseProcessor(storage_client=storage)
-            result = await processor.process_pdf(temp_file_path)
-
-            if not result:
-                raise HTTPException(
-                    status_code=500,
-                    detail="PDF processing failed to return results"
-                )
-
-            return {
-                "status": "success",
-                "message": "PDF processed successfully",
-                "document_id": result["document_id"],
-                "timestamp": result["timestamp"],
-                "content": result["content"],
-                "metadata": result["metadata"]
-            }
+        # UploadFile is already spooled, so read it once instead of copying it to another temp file
+        content = await file.read()
 
-        finally:
-            # Clean up the temporary file
-            try:
-                os.unlink(temp_file_path)
-            except Exception as e:
-                logger.warning(f"Error removing temporary file: {str(e)}")
+        # Process the PDF straight from memory
+        result = await pdf_processor_enterprise.process_pdf(content, file.filename)
+
+        if not result:
+            raise HTTPException(
+                status_code=500,
+                detail="PDF processing failed to return results"
+            )
+
+        return {
+            "status": "success",
+            "message": "PDF processed successfully",
+            "document_id": result["document_id"],
+            "timestamp": result["timestamp"],
+            "content": result["content"],
+            "metadata": result["metadata"]
+        }
 
     except Exception as e:
         logger.error(f"Error processing PDF: {str(e)}", exc_info=True)
@@ -234,14 +250,18 @@ async def process_pdf_enterprise(file: UploadFile = File(...)) -> Dict[str, Any]
             status_code=500,
             detail=f"Error processing PDF: {str(e)}"
         )
+    finally:
+        await file.close()
 
 # Opensource webpage endpoint
 @os_router.post("/process-webpage", response_model=ProcessingResponse)
-async def process_webpage_opensource(url_input: URLInput) -> Dict[str, Any]:
+async def process_webpage_opensource(
+    url_input: URLInput,
+    web_processor_os: WebProcessor = Depends(get_web_processor_os)
+) -> Dict[str, Any]:
     """Process webpage using opensource service"""
     try:
-        processor = WebProcessor()
-        result = await processor.process_webpage(url_input.url)
+        result = await web_processor_os.process_webpage(url_input.url)
         
         return {
             "status": result["status"],
@@ -251,6 +271,8 @@ async def process_webpage_opensource(url_input: URLInput) -> Dict[str, Any]:
             "content": result["content"],
             "metadata": result["metadata"]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing webpage: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -260,7 +282,10 @@ async def process_webpage_opensource(url_input: URLInput) -> Dict[str, Any]:
 
 # Enterprise webpage endpoint
 @enterprise_router.post("/process-webpage", response_model=ProcessingResponse)
-async def process_webpage_enterprise(request: WebsiteRequest):
+async def process_webpage_enterprise(
+    request: WebsiteRequest,
+    web_processor_enterprise: WebEnterpriseProcessor = Depends(get_web_processor_enterprise)
+):
     try:
         result = await web_processor_enterprise.process_webpage(str(request.url))
         
@@ -288,7 +313,10 @@ async def process_webpage_enterprise(request: WebsiteRequest):
 # Health check endpoint
 @os_router.get("/health")
 @enterprise_router.get("/health")
-async def health_check():
+async def health_check(
+    pdf_processor_enterprise: PDFEnterpriseProcessor = Depends(get_pdf_processor_enterprise),
+    web_processor_enterprise: WebEnterpriseProcessor = Depends(get_web_processor_enterprise)
+):
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
@@ -1,13 +1,17 @@
 # storage_handler.py
+import asyncio
+import aioboto3
 import boto3
 from botocore.exceptions import ClientError
 import logging
-import json
+import orjson
 import os
+import threading
+from contextlib import AsyncExitStack
 from datetime import datetime
-from typing import Optional, BinaryIO, Union
+from typing import Optional, BinaryIO, Tuple, Union
 from dotenv import load_dotenv
-import io
+import zstandard as zstd
 
 # Load environment variables
 load_dotenv()
@@ -19,6 +23,35 @@ AWS_REGION = os.getenv('AWS_REGION')
 
 logger = logging.getLogger(__name__)
 
+ZSTD_LEVEL = 3
+# Payloads smaller than this are stored as-is; compressing them saves next to nothing
+ZSTD_MIN_SIZE = 1024
+# Only payloads at least this large are worth zstd's multi-threaded compression
+ZSTD_THREADED_MIN_SIZE = 4 * 1024 * 1024
+UPLOAD_CONCURRENCY = 8
+
+# Compressors are reused, but a ZstdCompressor must not be shared between threads
+_compressors = threading.local()
+
+def _compressor(threaded: bool) -> zstd.ZstdCompressor:
+    """Return this thread's reusable compressor, single- or multi-threaded"""
+    attr = 'threaded' if threaded else 'single'
+    compressor = getattr(_compressors, attr, None)
+    if compressor is None:
+        compressor = zstd.ZstdCompressor(level=ZSTD_LEVEL, threads=-1 if threaded else 0)
+        setattr(_compressors, attr, compressor)
+    return compressor
+
+def zstd_compress(data: bytes) -> bytes:
+    """Compress a payload with zstd before upload"""
+    return _compressor(len(data) >= ZSTD_THREADED_MIN_SIZE).compress(data)
+
+def compress_for_upload(data: bytes, file_path: str) -> Tuple[bytes, str, Optional[str]]:
+    """zstd-compress a payload worth compressing; returns the body, its key and its Content-Encoding"""
+    if len(data) < ZSTD_MIN_SIZE:
+        return data, file_path, None
+    return zstd_compress(data), f"{file_path}.zst", 'zstd'
+
 class StorageHandler:
     def __init__(self, bucket_name: str, aws_access_key_id: str = None, 
                  aws_secret_access_key: str = None, region_name: str = None):
@@ -26,24 +59,58 @@ class StorageHandler:
                                     aws_access_key_id=aws_access_key_id or AWS_ACCESS_KEY_ID,
                                     aws_secret_access_key=aws_secret_access_key or AWS_SECRET_ACCESS_KEY,
                                     region_name=region_name or AWS_REGION)
+        self.session = aioboto3.Session(aws_access_key_id=aws_access_key_id or AWS_ACCESS_KEY_ID,
+                                        aws_secret_access_key=aws_secret_access_key or AWS_SECRET_ACCESS_KEY,
+                                        region_name=region_name or AWS_REGION)
         self.bucket_name = bucket_name
+        self._upload_semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+        self._async_client = None
+        self._async_client_stack = None
 
-    def upload(self, file_data: Union[BinaryIO, dict], file_path: str, content_type: str) -> Optional[str]:
+    async def startup(self):
+        """Open the aioboto3 S3 client shared by all async uploads"""
+        if self._async_client is None:
+            self._async_client_stack = AsyncExitStack()
+            self._async_client = await self._async_client_stack.enter_async_context(self.session.client('s3'))
+
+    async def shutdown(self):
+        """Close the shared aioboto3 S3 client"""
+        if self._async_client_stack is not None:
+            await self._async_client_stack.aclose()
+        self._async_client_stack = None
+        self._async_client = None
+
+    def upload(self, file_data: Union[bytes, BinaryIO, dict], file_path: str, content_type: str,
+               content_encoding: Optional[str] = None) -> Optional[str]:
         """
         Upload a file to S3 storage.
         
         Args:
-            file_data: Either a file-like object or a dictionary (for JSON data)
+            file_data: Raw bytes, a file-like object or a dictionary (for JSON data)
             file_path: The path/key where the file will be stored in S3
             content_type: The MIME type of the content being uploaded
+            content_encoding: Optional Content-Encoding of the payload (e.g. 'zstd')
         """
         try:
             # Handle dictionary input (convert to JSON)
             if isinstance(file_data, dict):
-                file_data = json.dumps(file_data).encode('utf-8')
-                file_data = io.BytesIO(file_data)
+                file_data = orjson.dumps(file_data)
                 content_type = 'application/json'
             
+            extra_args = {'ContentType': content_type}
+            if content_encoding:
+                extra_args['ContentEncoding'] = content_encoding
+            
+            # Small in-memory payloads go out in a single PUT, skipping the transfer manager
+            if isinstance(file_data, (bytes, bytearray, memoryview)):
+                self.s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=file_path,
+                    Body=bytes(file_data),
+                    **extra_args
+                )
+                return file_path
+            
             # Reset file pointer if it's a file-like object
             if hasattr(file_data, 'seek'):
                 file_data.seek(0)
@@ -52,7 +119,7 @@ class StorageHandler:
                 file_data,
                 self.bucket_name,
                 file_path,
-                ExtraArgs={'ContentType': content_type}
+                ExtraArgs=extra_args
             )
             return file_path
         
@@ -60,11 +127,73 @@ class StorageHandler:
             logger.error(f"Error uploading file to S3: {str(e)}")
             raise
 
+    async def upload_async(self, file_data: Union[bytes, BinaryIO, dict], file_path: str, content_type: str,
+                           content_encoding: Optional[str] = None) -> Optional[str]:
+        """
+        Upload a file to S3 storage without blocking the event loop.
+        
+        Args:
+            file_data: Raw bytes, a file-like object or a dictionary (for JSON data)
+            file_path: The path/key where the file will be stored in S3
+            content_type: The MIME type of the content being uploaded
+            content_encoding: Optional Content-Encoding of the payload (e.g. 'zstd')
+        """
+        try:
+            # Handle dictionary input (convert to JSON)
+            if isinstance(file_data, dict):
+                file_data = orjson.dumps(file_data)
+                content_type = 'application/json'
+            
+            extra_args = {'ContentType': content_type}
+            if content_encoding:
+                extra_args['ContentEncoding'] = content_encoding
+            
+            async with self._upload_semaphore:
+                if self._async_client is not None:
+                    await self._put_async(self._async_client, file_data, file_path, extra_args)
+                else:
+                    async with self.session.client('s3') as s3_client:
+                        await self._put_async(s3_client, file_data, file_path, extra_args)
+            return file_path
+        
+        except Exception as e:
+            logger.error(f"Error uploading file to S3: {str(e)}")
+            raise
+
+    async def _put_async(self, s3_client, file_data: Union[bytes, BinaryIO], file_path: str, extra_args: dict):
+        if isinstance(file_data, (bytes, bytearray, memoryview)):
+            await s3_client.put_object(
+                Bucket=self.bucket_name,
+                Key=file_path,
+                Body=bytes(file_data),
+                **extra_args
+            )
+        else:
+            if hasattr(file_data, 'seek'):
+                file_data.seek(0)
+            await s3_client.upload_fileobj(
+                file_data,
+                self.bucket_name,
+                file_path,
+                ExtraArgs=extra_args
+            )
+
+    def get_url(self, file_path: str, expires_in: int = 3600) -> str:
+        """Generate a presigned URL for reading a file directly from S3."""
+        return self.s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket_name, 'Key': file_path},
+            ExpiresIn=expires_in
+        )
+
     def download(self, file_path: str) -> Optional[bytes]:
         """Download a file from S3 storage."""
         try:
             response = self.s3_client.get_object(Bucket=self.bucket_name, Key=file_path)
-            return response['Body'].read()
+            body = response['Body'].read()
+            if response.get('ContentEncoding') == 'zstd':
+                body = zstd.ZstdDecompressor().decompressobj().decompress(body)
+            return body
         except Exception as e:
             logger.error(f"Error downloading file from S3: {str(e)}")
             raise
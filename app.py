@@ -1,19 +1,202 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import base64
+import hashlib
 import io
+import threading
+import json
 import markdown
+import pandas as pd
 from PIL import Image
+from typing import Dict, Any, Iterator, List
+from urllib.parse import urlparse
 
 # FastAPI backend URL
 API_URL = "https://content-extraction-api-607698884796.us-central1.run.app"  # Remove /docs from the URL
 
-def create_markdown_download(content: list, filename: str = "extracted_text.md") -> str:
+# Seconds to wait for each health endpoint before reporting it as failed
+HEALTH_TIMEOUT = 5
+
+# Seconds to wait for the backend to process a PDF or webpage
+PROCESS_TIMEOUT = 300
+
+# Seconds to wait when downloading an extracted image for display
+IMAGE_TIMEOUT = 10
+
+# Largest image the app downloads itself; bigger ones are left to the browser
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+
+# Concurrent downloads used to warm the image cache for a webpage's first images
+IMAGE_PREFETCH_WORKERS = 8
+IMAGE_PREFETCH_LIMIT = IMAGE_PREFETCH_WORKERS * 2
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """Return a pooled HTTP session shared by every rerun, so backend connections are kept alive"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class APIError(Exception):
+    """Raised when the backend answers a processing request with an error"""
+
+def _error_detail(response: requests.Response) -> str:
+    """Return the error detail of a failed backend response, whether or not its body is JSON"""
+    if response.headers.get("content-type", "").startswith("application/json"):
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        if isinstance(body, dict) and body.get("detail"):
+            return str(body["detail"])
+    return response.text[:500] or "Unknown error occurred."
+
+def _post_for_result(url: str, **kwargs) -> Dict[str, Any]:
+    """POST to the backend and return its JSON result, raising APIError on failure"""
+    response = get_session().post(url, timeout=PROCESS_TIMEOUT, **kwargs)
+    if response.status_code != 200:
+        raise APIError(_error_detail(response))
+    return response.json()
+
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def process_pdf(endpoint: str, filename: str, file_hash: str, _pdf_bytes: bytes) -> Dict[str, Any]:
+    """Process a PDF through the backend, memoized on endpoint, filename and content hash"""
+    files = {"file": (filename, _pdf_bytes, "application/pdf")}
+    return _post_for_result(f"{API_URL}/{endpoint}/process-pdf", files=files)
+
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def process_webpage(endpoint: str, url: str) -> Dict[str, Any]:
+    """Process a webpage through the backend, memoized on endpoint and URL"""
+    return _post_for_result(f"{API_URL}/{endpoint}/process-webpage", json={"url": url})
+
+def create_markdown_download(content: list) -> str:
     """Create a markdown file for download"""
-    markdown_content = "\n\n".join(content)
-    b64 = base64.b64encode(markdown_content.encode()).decode()
-    return f'<a href="data:file/markdown;base64,{b64}" download="{filename}">Download Markdown</a>'
+    return "\n\n".join(content)
+
+@st.cache_data(max_entries=64)
+def table_to_csv(table: list) -> str:
+    """Serialize a table to CSV with proper quoting, using pandas' C writer"""
+    return pd.DataFrame(table).to_csv(index=False, header=False)
+
+@st.cache_data(max_entries=64)
+def table_to_dataframe(table: list) -> pd.DataFrame:
+    """Build a DataFrame from a table, using its first row as the header when it is usable"""
+    header = [str(cell) for cell in table[0]] if table else []
+    rows = table[1:]
+    if rows and all(header) and len(set(header)) == len(header) and all(len(row) == len(header) for row in rows):
+        return pd.DataFrame(rows, columns=header)
+    return pd.DataFrame(table)
+
+def _webpage_markdown_lines(result: Dict[str, Any]) -> Iterator[str]:
+    """Yield the lines of the markdown export of a processed webpage"""
+    metadata = result["metadata"]
+    content = result["content"]
+    
+    # Add title if available
+    if "title" in metadata:
+        yield f"# {metadata['title']}\n"
+    
+    # Add metadata section
+    yield "## Metadata\n"
+    yield from (f"- **{key}**: {value}" for key, value in metadata.items() if key != "storage_paths")
+    yield "\n"
+    
+    # Add main content
+    yield "## Content\n"
+    yield from content.get("text", ())
+    
+    # Add images section
+    if content.get("images"):
+        yield "\n## Images\n"
+        for img in content["images"]:
+            alt_text = img.get('alt', '') or img.get('title', 'Image')
+            yield f"![{alt_text}]({img['url']})\n"
+    
+    # Add tables section; the tables themselves are rendered as widgets
+    if content.get("tables"):
+        yield "\n## Tables\n"
+    
+    # Add links section
+    if content.get("links"):
+        yield "\n## Links\n"
+        yield from (f"- [{link['text']}]({link['url']})" for link in content["links"])
+
+@st.cache_data(max_entries=16)
+def build_webpage_markdown(result_json: str) -> tuple:
+    """Build the markdown export of a processed webpage and its metadata JSON"""
+    result = json.loads(result_json)
+    markdown_content = "\n".join(_webpage_markdown_lines(result))
+    metadata_json = json.dumps(result["metadata"])
+    return markdown_content, metadata_json
+
+def pick_item(label: str, count: int, key: str) -> int:
+    """Let the user pick one of ``count`` items; the position is kept in session state"""
+    if count < 2:
+        return 1
+    return st.slider(label, 1, count, key=key)
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def fetch_img(url: str) -> bytes:
+    """Download an http(s) image of at most MAX_IMAGE_BYTES once, so reruns don't refetch it"""
+    if urlparse(url).scheme not in ("http", "https"):
+        raise ValueError(f"Unsupported image URL: {url}")
+
+    with get_session().get(url, timeout=IMAGE_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        content_type = response.headers.get("content-type", "")
+        if not content_type.startswith("image/"):
+            raise ValueError(f"Not an image: {content_type}")
+        content_length = response.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > MAX_IMAGE_BYTES:
+            raise ValueError(f"Image exceeds {MAX_IMAGE_BYTES} bytes")
+
+        # The declared length may be missing or wrong, so enforce the cap on what actually arrives
+        chunks = []
+        received = 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            received += len(chunk)
+            if received > MAX_IMAGE_BYTES:
+                raise ValueError(f"Image exceeds {MAX_IMAGE_BYTES} bytes")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+def prefetch_images(images: List[Dict[str, Any]]):
+    """Download the first URL images concurrently so paging through them starts from a warm cache"""
+    # The panel shows one image at a time, so later images are only fetched when picked
+    urls = [img["url"] for img in images or () if "url" in img][:IMAGE_PREFETCH_LIMIT]
+    if len(urls) < 2:
+        return
+
+    # Cached functions expect the script's run context, which worker threads don't have
+    ctx = get_script_run_ctx()
+
+    def fetch(url):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        try:
+            fetch_img(url)
+        except Exception:
+            # Failed images are retried, or loaded by the browser, when displayed
+            pass
+
+    with ThreadPoolExecutor(max_workers=IMAGE_PREFETCH_WORKERS) as executor:
+        list(executor.map(fetch, urls))
+
+def display_image_from_url(url: str, caption=""):
+    """Display image from a URL, using the locally cached bytes when they can be fetched"""
+    try:
+        st.image(fetch_img(url), caption=caption, use_column_width=True)
+    except Exception:
+        # Let the browser load images we can't or won't fetch ourselves; st.image reads
+        # anything that isn't a web URL from the server's disk, so never pass those on
+        if urlparse(url).scheme in ("http", "https"):
+            st.image(url, caption=caption, use_column_width=True)
+        else:
+            st.write(f"Image not displayed: `{url}`")
 
 def display_image_from_bytes(image_bytes, caption=""):
     """Display image from bytes data"""
@@ -23,28 +206,49 @@ def display_image_from_bytes(image_bytes, caption=""):
     except Exception as e:
         st.error(f"Error displaying image: {str(e)}")
 
+def render_metadata_panel(metadata: Dict[str, Any], metadata_json: str = None):
+    """Display the metadata and storage paths of a processing result"""
+    st.write("### Metadata")
+    st.json(metadata_json or metadata)
+
+    # Display storage paths
+    if "storage_paths" in metadata:
+        st.write("#### Storage Paths")
+        for key, path in metadata["storage_paths"].items():
+            st.write(f"**{key}:** `{path}`")
+
+@st.fragment
+def render_images_panel(images: List[Dict[str, Any]], key: str):
+    """Display extracted images one at a time; picking another image only reruns this panel"""
+    if not images:
+        return
+
+    st.write("#### Images")
+    img_num = pick_item("Image", len(images), key)
+    img = images[img_num - 1]
+    if "page" in img:
+        caption = f"Page {img['page']}, Index {img['index']}"
+    else:
+        caption = img.get("title", "") or img.get("alt", "")
+
+    if "data" in img:
+        display_image_from_bytes(img["data"], caption)
+        
+        # Add image download button
+        st.download_button(
+            f"Download Image {img_num}",
+            data=img["data"],
+            file_name=f"image_{img_num}.{img['ext']}",
+            mime=f"image/{img['ext']}"
+        )
+    elif "url" in img:
+        display_image_from_url(img["url"], caption)
+        st.markdown(f"[Download Image]({img['url']})")
+
 # Streamlit app title
 st.set_page_config(page_title="Document Processing App", layout="wide")
 st.title("📄 Document Processing App")
 
-# Add this at the top of your Streamlit app
-st.markdown("""
-    <style>
-    .button {
-        display: inline-block;
-        padding: 0.5em 1em;
-        background-color: #4CAF50;
-        color: white;
-        text-decoration: none;
-        border-radius: 4px;
-        margin: 10px 0;
-    }
-    .button:hover {
-        background-color: #45a049;
-    }
-    </style>
-    """, unsafe_allow_html=True)
-
 # Tabs for different functionalities
 tab1, tab2, tab3 = st.tabs(["📤 Process PDF", "🌐 Process Webpage", "⚙️ Health Check"])
 
@@ -79,94 +283,79 @@ with tab1:
                     full_url = f"{API_URL}/{endpoint}/process-pdf"
                     st.info(f"Calling API URL: {full_url}")
                     
-                    # Send file to FastAPI endpoint
-                    files = {"file": (uploaded_file.name, uploaded_file, "application/pdf")}
+                    # Send file to FastAPI endpoint; re-processing the same upload reuses the result
+                    pdf_bytes = uploaded_file.getvalue()
+                    file_hash = hashlib.blake2b(pdf_bytes, digest_size=16).hexdigest()
                     
-                    response = requests.post(full_url, files=files)
-
-                    if response.status_code == 200:
-                        result = response.json()
-
-                        # Display success message and results
-                        st.success("PDF processed successfully!")
-                        
-                        # Create columns for layout
-                        col1, col2 = st.columns([2, 1])
-                        
-                        with col1:
-                            # Display extracted content
-                            st.write("### Extracted Content")
-                            
-                            # Display text content
-                            if "text" in result["content"]:
-                                st.write("#### Text Content")
-                                
-                                # Create markdown download button
-                                st.markdown(
-                                    create_markdown_download(result["content"]["text"], 
-                                    f"{uploaded_file.name}_extracted.md"),
-                                    unsafe_allow_html=True
-                                )
-                                
-                                for page_num, text in enumerate(result["content"]["text"], 1):
-                                    with st.expander(f"Page {page_num}"):
-                                        st.markdown(text)
-
-                            # Display tables
-                            if "tables" in result["content"] and result["content"]["tables"]:
-                                st.write("#### Tables")
-                                for table_num, table in enumerate(result["content"]["tables"], 1):
-                                    with st.expander(f"Table {table_num}"):
-                                        st.table(table)
-                                        
-                                        # Add CSV download button for each table
-                                        csv = '\n'.join([','.join(map(str, row)) for row in table])
-                                        b64 = base64.b64encode(csv.encode()).decode()
-                                        href = f'<a href="data:file/csv;base64,{b64}" download="table_{table_num}.csv">Download CSV</a>'
-                                        st.markdown(href, unsafe_allow_html=True)
-
-                            # Display key-value pairs (for enterprise)
-                            if "key_value_pairs" in result["content"]:
-                                st.write("#### Key-Value Pairs")
-                                for key, value in result["content"]["key_value_pairs"].items():
-                                    st.write(f"**{key}:** {value}")
-                        
-                        with col2:
-                            # Display metadata
-                            st.write("### Metadata")
-                            st.json(result["metadata"])
-
-                            # Display storage paths
-                            if "storage_paths" in result["metadata"]:
-                                st.write("#### Storage Paths")
-                                for key, path in result["metadata"]["storage_paths"].items():
-                                    st.write(f"**{key}:** `{path}`")
-
-                            # Display images if available
-                            if "images" in result["content"]:
-                                st.write("#### Images")
-                                for img_num, img in enumerate(result["content"]["images"], 1):
-                                    with st.expander(f"Image {img_num}"):
-                                        if "data" in img:
-                                            display_image_from_bytes(
-                                                img["data"],
-                                                f"Page {img['page']}, Index {img['index']}"
-                                            )
-                                            
-                                            # Add image download button
-                                            b64 = base64.b64encode(img["data"]).decode()
-                                            href = f'<a href="data:image/{img["ext"]};base64,{b64}" download="image_{img_num}.{img["ext"]}">Download Image</a>'
-                                            st.markdown(href, unsafe_allow_html=True)
-
-                    else:
-                        # Handle errors from the API
-                        error_message = response.json().get("detail", "Unknown error occurred.")
-                        st.error(f"Failed to process PDF: {error_message}")
+                    # Keep the result across reruns triggered by the page/table/image pickers
+                    st.session_state["pdf_result"] = process_pdf(endpoint, uploaded_file.name, file_hash, pdf_bytes)
+                    st.session_state["pdf_filename"] = uploaded_file.name
+                    for key in ("pdf_page", "pdf_table", "pdf_image"):
+                        st.session_state.pop(key, None)
+
+                    # Display success message
+                    st.success("PDF processed successfully!")
+
+                except APIError as e:
+                    # Handle errors from the API
+                    st.error(f"Failed to process PDF: {str(e)}")
 
                 except Exception as e:
                     # Handle client-side errors
                     st.error(f"An error occurred while processing the PDF: {str(e)}")
 
+        # Display the results of the last processed PDF
+        result = st.session_state.get("pdf_result")
+        if result is not None and st.session_state.get("pdf_filename") == uploaded_file.name:
+            # Create columns for layout
+            col1, col2 = st.columns([2, 1])
+            
+            with col1:
+                # Display extracted content
+                st.write("### Extracted Content")
+                
+                # Display text content, one page at a time
+                texts = result["content"].get("text")
+                if texts:
+                    st.write("#### Text Content")
+                    
+                    # Create markdown download button
+                    st.download_button(
+                        "Download Markdown",
+                        data=create_markdown_download(texts),
+                        file_name=f"{uploaded_file.name}_extracted.md",
+                        mime="text/markdown"
+                    )
+                    
+                    page_num = st.number_input("Page", 1, len(texts), key="pdf_page")
+                    st.markdown(texts[page_num - 1])
+
+                # Display tables, one table at a time
+                tables = result["content"].get("tables")
+                if tables:
+                    st.write("#### Tables")
+                    table_num = pick_item("Table", len(tables), "pdf_table")
+                    table = tables[table_num - 1]
+                    st.dataframe(table_to_dataframe(table), use_container_width=True)
+                    
+                    # Add CSV download button for the table
+                    st.download_button(
+                        f"Download CSV {table_num}",
+                        data=table_to_csv(table),
+                        file_name=f"table_{table_num}.csv",
+                        mime="text/csv"
+                    )
+
+                # Display key-value pairs (for enterprise)
+                if "key_value_pairs" in result["content"]:
+                    st.write("#### Key-Value Pairs")
+                    for key, value in result["content"]["key_value_pairs"].items():
+                        st.write(f"**{key}:** {value}")
+            
+            with col2:
+                render_metadata_panel(result["metadata"])
+                render_images_panel(result["content"].get("images"), "pdf_image")
+
 # Tab 2: Process Webpage
 with tab2:
     st.header("Process a Webpage")
@@ -190,106 +379,21 @@ with tab2:
                     # Determine endpoint based on processor type
                     endpoint = "api/v1/opensource" if "Opensource" in processor_type else "api/v1/enterprise"
                     
-                    # Send request to FastAPI endpoint
-                    response = requests.post(
-                        f"{API_URL}/{endpoint}/process-webpage",
-                        json={"url": url}
-                    )
+                    # Send request to FastAPI endpoint; repeated clicks on the same URL reuse the result
+                    result = process_webpage(endpoint, url)
+
+                    # Keep the result across reruns, e.g. those triggered by the download button
+                    st.session_state["web_result"] = result
+                    st.session_state["web_url"] = url
+                    st.session_state.pop("web_image", None)
+                    prefetch_images(result["content"].get("images"))
+
+                    # Display success message
+                    st.success("Webpage processed successfully!")
 
-                    if response.status_code == 200:
-                        result = response.json()
-
-                        # Display success message and results
-                        st.success("Webpage processed successfully!")
-                        
-                        # Create columns for layout
-                        col1, col2 = st.columns([2, 1])
-                        
-                        with col1:
-                            # Generate and display markdown content
-                            st.write("### Extracted Content")
-                            
-                            # Create markdown content
-                            markdown_lines = []
-                            
-                            # Add title if available
-                            if "title" in result["metadata"]:
-                                markdown_lines.append(f"# {result['metadata']['title']}\n")
-                            
-                            # Add metadata section
-                            markdown_lines.append("## Metadata\n")
-                            for key, value in result["metadata"].items():
-                                if key != "storage_paths":
-                                    markdown_lines.append(f"- **{key}**: {value}")
-                            markdown_lines.append("\n")
-                            
-                            # Add main content
-                            markdown_lines.append("## Content\n")
-                            if "text" in result["content"]:
-                                markdown_lines.extend(result["content"]["text"])
-                            
-                            # Add images section
-                            if "images" in result["content"] and result["content"]["images"]:
-                                markdown_lines.append("\n## Images\n")
-                                for img in result["content"]["images"]:
-                                    alt_text = img.get('alt', '') or img.get('title', 'Image')
-                                    markdown_lines.append(f"![{alt_text}]({img['url']})\n")
-                            
-                            # Add tables section
-                            if "tables" in result["content"] and result["content"]["tables"]:
-                                markdown_lines.append("\n## Tables\n")
-                                for table in result["content"]["tables"]:
-                                    if table:
-                                        # Display table in markdown format
-                                        st.write("#### Table")
-                                        st.table(table)
-                            
-                            # Add links section
-                            if "links" in result["content"] and result["content"]["links"]:
-                                markdown_lines.append("\n## Links\n")
-                                for link in result["content"]["links"]:
-                                    markdown_lines.append(f"- [{link['text']}]({link['url']})")
-                            
-                            # Join all markdown content
-                            markdown_content = "\n".join(markdown_lines)
-                            
-                            # Display markdown content
-                            st.markdown(markdown_content)
-                            
-                            # Create download button for markdown
-                            b64 = base64.b64encode(markdown_content.encode()).decode()
-                            filename = "extracted_webpage.md"
-                            st.markdown(
-                                f'<a href="data:file/markdown;base64,{b64}" download="{filename}" '
-                                'class="button">📥 Download Markdown</a>',
-                                unsafe_allow_html=True
-                            )
-                            
-                        with col2:
-                            # Display metadata and storage paths
-                            st.write("### Metadata")
-                            st.json(result["metadata"])
-
-                            # Display storage paths
-                            if "storage_paths" in result["metadata"]:
-                                st.write("#### Storage Paths")
-                                for key, path in result["metadata"]["storage_paths"].items():
-                                    st.write(f"**{key}:** `{path}`")
-
-                            # Display images in sidebar
-                            if "images" in result["content"] and result["content"]["images"]:
-                                st.write("### Images")
-                                for img_num, img in enumerate(result["content"]["images"], 1):
-                                    with st.expander(f"Image {img_num}"):
-                                        if "url" in img:
-                                            st.image(img["url"], 
-                                                    caption=img.get("title", "") or img.get("alt", ""),
-                                                    use_column_width=True)
-
-                    else:
-                        # Handle errors from the API
-                        error_message = response.json().get("detail", "Unknown error occurred.")
-                        st.error(f"Failed to process webpage: {error_message}")
+                except APIError as e:
+                    # Handle errors from the API
+                    st.error(f"Failed to process webpage: {str(e)}")
 
                 except Exception as e:
                     # Handle client-side errors
@@ -298,15 +402,59 @@ with tab2:
         else:
             st.warning("Please enter a valid URL")
 
+    # Display the results of the last processed webpage
+    result = st.session_state.get("web_result")
+    if result is not None and st.session_state.get("web_url") == url:
+        # Create columns for layout
+        col1, col2 = st.columns([2, 1])
+        
+        with col1:
+            # Generate and display markdown content
+            st.write("### Extracted Content")
+            
+            # Build markdown content once per result; reruns reuse the cached copy
+            markdown_content, metadata_json = build_webpage_markdown(
+                json.dumps(result, sort_keys=True)
+            )
+            
+            # Display tables
+            if "tables" in result["content"] and result["content"]["tables"]:
+                for table in result["content"]["tables"]:
+                    if table:
+                        # Display table in markdown format
+                        st.write("#### Table")
+                        st.dataframe(table_to_dataframe(table), use_container_width=True)
+            
+            # Display markdown content
+            st.markdown(markdown_content)
+            
+            # Create download button for markdown
+            st.download_button(
+                "📥 Download Markdown",
+                data=markdown_content,
+                file_name="extracted_webpage.md",
+                mime="text/markdown"
+            )
+            
+        with col2:
+            render_metadata_panel(result["metadata"], metadata_json)
+            render_images_panel(result["content"].get("images"), "web_image")
+
 # Tab 3: Health Check
 with tab3:
     st.header("Health Check")
     if st.button("🔍 Check API Health"):
         with st.spinner("Checking API health..."):
             try:
-                # Check both opensource and enterprise health
-                os_response = requests.get(f"{API_URL}/api/v1/opensource/health")
-                ent_response = requests.get(f"{API_URL}/api/v1/enterprise/health")
+                # Check both opensource and enterprise health concurrently
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    os_future = executor.submit(
+                        get_session().get, f"{API_URL}/api/v1/opensource/health", timeout=HEALTH_TIMEOUT
+                    )
+                    ent_future = executor.submit(
+                        get_session().get, f"{API_URL}/api/v1/enterprise/health", timeout=HEALTH_TIMEOUT
+                    )
+                    os_response, ent_response = os_future.result(), ent_future.result()
                 
                 if os_response.status_code == 200 and ent_response.status_code == 200:
                     os_status = os_response.json()